@@ -0,0 +1,68 @@
+"""Label agreement and throughput of the inference backends.
+
+Cells are cut from the scans of a restored set, export the onnx model first.
+Run from the repository root:
+    python -m app.benchmark.backends sets/demo --backends keras onnx
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from app.source.modules.reader import AnswerRecognizer, RecognitionPlan, read_page, scan_paths
+
+
+def load_rois(set_path, limit=None):
+    with open(os.path.join(set_path, 'generator_data.json'), 'r') as f:
+        plan = RecognitionPlan(json.load(f))
+    image_paths = sorted(scan_paths(os.path.join(set_path, 'scans')))
+    rois = [read_page(image_path, plan)[1] for image_path in image_paths[:limit]]
+    return np.concatenate(rois)
+
+
+def run(set_path, backend_names, model_path, limit, repeat):
+    rois = load_rois(set_path, limit)
+    report = {'cells': len(rois), 'backends': {}}
+    labels = {}
+    for name in backend_names:
+        recognizer = AnswerRecognizer(model_path, name)
+        start = time.perf_counter()
+        recognizer.classify(rois[:1])
+        load_time = time.perf_counter() - start
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            labels[name], _ = recognizer.classify(rois)
+            times.append(time.perf_counter() - start)
+        best = min(times)
+        report['backends'][name] = {
+            'load_s': round(load_time, 3),
+            'classify_s': round(best, 4),
+            'cells_per_s': round(len(rois) / best)
+        }
+        print(name, report['backends'][name])
+    reference = backend_names[0]
+    for name in backend_names[1:]:
+        mismatch = int(np.count_nonzero(labels[name] != labels[reference]))
+        report['backends'][name]['label_mismatches'] = mismatch
+        print(f'{name} vs {reference}: {mismatch} of {len(rois)} labels differ')
+    return report
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('set_path', type=str, help='set folder with scans/ and generator_data.json')
+    ap.add_argument('--backends', nargs='+', default=['keras', 'onnx'])
+    ap.add_argument('--model', type=str, default='app/model/AM_50.model')
+    ap.add_argument('--pages', type=int, default=None, help='use only the first pages')
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--output', type=str, default=None,
+                    help='write the report as json')
+    args = ap.parse_args()
+    report = run(args.set_path, args.backends, args.model, args.pages, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,79 @@
+"""Columnar vs row-wise grading on synthetic answer tables.
+
+Run from the repository root:
+    python -m app.benchmark.grade --rows 10000 100000 1000000
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import app.source.modules.evaluator as eval
+
+
+def synthetic_table(rows, problems, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {'Code': [f'{idx:07}' for idx in range(rows)]}
+    for idx, pr in enumerate(problems):
+        letters = np.array(list(pr.ref_ans + '_'))
+        picks = rng.integers(0, len(letters), size=(rows, len(pr.ref_ans)))
+        data[f'S1Q{idx+1}'] = [''.join(row) for row in letters[picks]]
+    return pd.DataFrame(data)
+
+
+def eval_table_rowwise(evaluator, evl_table):
+    '''
+    Row by row grading as it was done before the columnar engine
+    '''
+    count = len(evaluator.problem_list)
+    pts_table = evl_table.copy()
+    for row_index in range(pts_table.shape[0]):
+        ans = evl_table.iloc[row_index][-count:]
+        pts_table.iloc[row_index, -count:] = evaluator.eval_list(ans)
+    return pts_table
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(sizes, rowwise_limit):
+    problems = [
+        eval.SortProblem(ref_ans='ABCDE', max_pts=5, min_share=0.5),
+        eval.MatchProblem(ref_ans='BADCE', max_pts=5),
+        eval.SortProblem(ref_ans='ABCDEFG', max_pts=5, min_share=0.5),
+        eval.MatchProblem(ref_ans='ABC', max_pts=5),
+    ]
+    evaluator = eval.Evaluator(*problems)
+    report = []
+    for rows in sizes:
+        table = synthetic_table(rows, problems)
+        columnar, columnar_time = timed(evaluator.eval_table, table)
+        entry = {'rows': rows, 'columnar_s': round(columnar_time, 4)}
+        if rows <= rowwise_limit:
+            rowwise, rowwise_time = timed(eval_table_rowwise, evaluator, table)
+            pd.testing.assert_frame_equal(columnar, rowwise, check_dtype=False)
+            entry['rowwise_s'] = round(rowwise_time, 4)
+            entry['speedup'] = round(rowwise_time / columnar_time, 1)
+        report.append(entry)
+        print(entry)
+    return report
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    ap.add_argument('--rowwise-limit', type=int, default=100000,
+                    help='largest table graded with the row-wise loop')
+    ap.add_argument('--output', type=str, default=None,
+                    help='write the report as json')
+    args = ap.parse_args()
+    report = run(args.rows, args.rowwise_limit)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,221 @@
+"""End-to-end restore, recognize and grade timings on synthetic scan sets.
+
+Blanks come from BlankGenerator, every cell is filled with a random letter
+(or left empty), pages are distorted like a real scan (rotation, scale,
+shift, noise, jpeg artifacts) and written into scans.pdf. Everything is
+seeded and runs offline. Run from the repository root:
+    python -m app.benchmark.pipeline --sheets 10 100 -j 4 --output pipeline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from app.source.modules.generator import BlankGenerator
+from app.source.modules.reader import RecognitionPlan, scan_paths
+from app.source.set_manager import SetManager
+from app.source.utils.config import config
+from app.source.utils.metrics import metrics
+from app.source.utils.pdf import PdfWriter
+
+LETTERS = 'ABCDEFGHIJKLM'
+FONTS = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_PLAIN, cv2.FONT_HERSHEY_DUPLEX]
+
+
+def make_description(sheets, rng, sections=1, questions=6):
+    # every section of a blank starts at the same place and rows below the sixth
+    # reach the bottom qr code, so one section of six questions is used
+    return {
+        'Codes': {'B-': sheets},
+        'Sections': [
+            {
+                'Questions': [
+                    {
+                        'ans': ''.join(rng.choice(list(LETTERS), size=rng.integers(4, 8), replace=False)),
+                        'type': ['SORT', 'MATCH'][idx % 2]
+                    } for idx in range(questions)
+                ]
+            } for _ in range(sections)
+        ]
+    }
+
+
+def fill_cells(canvas, plan, rng, empty_share=0.15):
+    '''
+    Write a random letter into every cell, returns the letters ('_' for empty cells)
+    '''
+    letters = []
+    for x1, y1, x2, y2 in plan.boxes.tolist():
+        if rng.random() < empty_share:
+            letters.append('_')
+            continue
+        letter = str(rng.choice(list(LETTERS)))
+        font = FONTS[rng.integers(len(FONTS))]
+        scale = rng.uniform(1.2, 1.6) * (2 if font == cv2.FONT_HERSHEY_PLAIN else 1)
+        thickness = int(rng.integers(2, 5))
+        (w, h), _ = cv2.getTextSize(letter, font, scale, thickness)
+        x = (x1 + x2 - w) // 2 + int(rng.integers(-4, 5))
+        y = (y1 + y2 + h) // 2 + int(rng.integers(-4, 5))
+        cv2.putText(canvas, letter, (x, y), font, scale, 0, thickness, cv2.LINE_AA)
+        letters.append(letter)
+    return letters
+
+
+def hide_qr_codes(canvas, rng):
+    '''
+    Paint over one or two of the three qr codes, as a fold or a stain would
+    '''
+    positions = list(config.qr.coords)
+    for pos in rng.choice(positions, size=rng.integers(1, 3), replace=False):
+        (x1, y1), (x2, y2) = config.qr.coords[pos]
+        canvas[max(y1 - 10, 0):y2 + 10, max(x1 - 10, 0):x2 + 10] = 255
+
+
+def distort(canvas, rng, max_angle=1.5, max_scale=0.02, max_shift=15, noise=6.0, jpeg_quality=(60, 90)):
+    '''
+    Imitate a scanner: small rotation, scale and shift, sensor noise, jpeg compression
+    '''
+    h, w = canvas.shape[:2]
+    M = cv2.getRotationMatrix2D(
+        (w / 2, h / 2),
+        rng.uniform(-max_angle, max_angle),
+        1 + rng.uniform(-max_scale, max_scale)
+    )
+    M[:, 2] += rng.uniform(-max_shift, max_shift, size=2)
+    page = cv2.warpAffine(canvas, M, (w, h), flags=cv2.INTER_LINEAR, borderValue=255)
+    page = np.clip(page + rng.normal(0, noise, page.shape), 0, 255).astype(np.uint8)
+    quality = int(rng.integers(*jpeg_quality))
+    return cv2.imdecode(cv2.imencode('.jpg', page, [cv2.IMWRITE_JPEG_QUALITY, quality])[1], cv2.IMREAD_GRAYSCALE)
+
+
+def build_set(set_path, sheets, seed, hide_qr=0.0):
+    '''
+    Generate the set with scans.pdf, returns true answers of every sheet by column.
+    hide_qr share of sheets loses one or two qr codes
+    '''
+    rng = np.random.default_rng(seed)
+    # отдельный генератор, чтобы hide_qr не менял остальной комплект
+    hide_rng = np.random.default_rng(seed + 1)
+    os.makedirs(set_path)
+    with open(os.path.join(set_path, 'description.json'), 'w') as f:
+        json.dump(make_description(sheets, rng), f, indent=4)
+
+    bg = BlankGenerator(set_path)
+    bg.draw_template()
+    bg.dump()
+    with open(os.path.join(set_path, 'generator_data.json'), 'r') as f:
+        plan = RecognitionPlan(json.load(f))
+
+    truth = {}
+    with PdfWriter(os.path.join(set_path, 'scans.pdf')) as writer:
+        for key, blank in bg.iter_blanks():
+            letters = fill_cells(blank.canvas, plan, rng)
+            truth[key] = {
+                f'S{section_idx+1}Q{question_idx+1}': ''.join(letters[start:stop])
+                for section_idx, question_idx, start, stop in plan.questions
+            }
+            if hide_rng.random() < hide_qr:
+                hide_qr_codes(blank.canvas, hide_rng)
+            writer.add_page(distort(blank.canvas, rng))
+    return truth
+
+
+def accuracy(set_path, truth):
+    import pandas as pd
+
+    recognized = pd.read_csv(os.path.join(set_path, 'recognized.csv'), index_col=0, dtype=str)
+    cells = correct = 0
+    for key, answers in truth.items():
+        for column, ans in answers.items():
+            cells += len(ans)
+            if key in recognized.index:
+                found = str(recognized.at[key, column])
+                correct += sum(a == b for a, b in zip(ans, found))
+    return round(correct / cells, 4) if cells else 0
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args, **kwargs)
+    return round(time.perf_counter() - start, 3), result
+
+
+def run_size(workdir, sheets, jobs, backend, seed, hide_qr=0.0):
+    sm = SetManager(path=os.path.join(workdir, 'sets', ''))
+    set_name = f'bench_{sheets}'
+    set_path = os.path.join(sm.path, set_name)
+    shutil.rmtree(set_path, ignore_errors=True)
+
+    start = time.perf_counter()
+    truth = build_set(set_path, sheets, seed, hide_qr)
+    entry = {'sheets': sheets, 'build_s': round(time.perf_counter() - start, 3)}
+
+    metrics.drain()
+    entry['restore_s'], restore_stats = timed(sm.restore_blanks, set_name, jobs=jobs)
+    entry['qr_recovery'] = restore_stats['recovery']
+    entry['recognize_s'], _ = timed(sm.get_answers, set_name, jobs=jobs, backend=backend)
+    entry['grade_s'], _ = timed(sm.get_results, set_name)
+    entry['stages'] = metrics.to_dict()
+    metrics.drain()
+
+    entry['restored'] = len(scan_paths(os.path.join(set_path, 'scans')))
+    entry['cell_accuracy'] = accuracy(set_path, truth)
+    for stage in ('restore', 'recognize', 'grade'):
+        seconds = entry[f'{stage}_s']
+        entry[f'{stage}_sheets_per_s'] = round(sheets / seconds, 2) if seconds else None
+    return entry
+
+
+def run(sizes, jobs, backend, seed, workdir=None, hide_qr=0.0):
+    keep = workdir is not None
+    workdir = workdir or tempfile.mkdtemp(prefix='form_bench_')
+    metrics.enabled = True
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'cpus': os.cpu_count(),
+        },
+        'settings': {'jobs': jobs, 'backend': backend, 'seed': seed, 'hide_qr': hide_qr},
+        'runs': []
+    }
+    try:
+        for sheets in sizes:
+            entry = run_size(workdir, sheets, jobs, backend, seed, hide_qr)
+            report['runs'].append(entry)
+            print({key: value for key, value in entry.items() if key != 'stages'})
+    finally:
+        metrics.enabled = False
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sheets', type=int, nargs='+', default=[10, 100])
+    ap.add_argument('-j', '--jobs', type=int, default=1)
+    ap.add_argument('--backend', choices=['keras', 'onnx'], default='keras')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--hide-qr', type=float, default=0.0,
+                    help='share of sheets with one or two qr codes painted over')
+    ap.add_argument('--workdir', type=str, default=None,
+                    help='keep the generated sets here instead of a temporary folder')
+    ap.add_argument('--output', type=str, default=None,
+                    help='write the report as json')
+    args = ap.parse_args()
+    report = run(args.sheets, args.jobs, args.backend, args.seed, args.workdir, args.hide_qr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
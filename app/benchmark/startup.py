@@ -0,0 +1,55 @@
+"""Import time paid by every main.py mode before it starts working.
+
+Run from the repository root:
+    python -m app.benchmark.startup --repeat 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# modules every mode imports, mirrors the lazy imports of SetManager
+MODE_IMPORTS = {
+    'create': [],
+    'generate': ['app.source.modules.generator', 'app.source.utils.pdf'],
+    'restore': ['app.source.modules.restorer', 'app.source.utils.pdf', 'pdf2image'],
+    'recognize': ['app.source.modules.reader', 'pandas'],
+    'recognize (first predict)': ['app.source.modules.reader', 'pandas', 'keras.models'],
+    'grade': ['pandas', 'app.source.modules.evaluator'],
+}
+
+
+def measure(modules, repeat):
+    code = 'import time; start = time.perf_counter(); import app.source.set_manager; '
+    code += ''.join(f'import {module}; ' for module in modules)
+    code += 'print(time.perf_counter() - start)'
+    times = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        if proc.returncode != 0:
+            return None
+        times.append(float(proc.stdout))
+    return round(statistics.median(times), 4)
+
+
+def run(repeat):
+    report = {}
+    for mode, modules in MODE_IMPORTS.items():
+        report[mode] = measure(modules, repeat)
+        shown = 'not installed' if report[mode] is None else f'{report[mode]} s'
+        print(f'{mode:>26}: {shown}')
+    return report
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--output', type=str, default=None,
+                    help='write the report as json')
+    args = ap.parse_args()
+    report = run(args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,122 @@
+"""Inference backends for the answer recognizer.
+
+The Keras backend needs the full TensorFlow runtime, the onnx one runs the
+exported model with onnxruntime or, without it, through OpenCV which is
+already required by the pipeline.
+Export the model once from the repository root:
+    python -m app.source.modules.backends app/model/AM_50.model app/model/AM_50.onnx
+"""
+
+import os
+import sys
+
+import numpy as np
+
+
+class KerasBackend:
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self._model = None
+
+    @property
+    def model(self):
+        '''
+        Keras is imported and the model is loaded on the first recognition only
+        '''
+        if self._model is None:
+            from keras.models import load_model
+            self._model = load_model(self.model_path)
+        return self._model
+
+    def predict(self, array, batch_size):
+        return self.model.predict(array, batch_size=batch_size, verbose=0)
+
+
+class OnnxBackend:
+    '''
+    Runs the exported model on CPU with onnxruntime when it is installed,
+    otherwise with cv2.dnn
+    '''
+    # cv2.dnn быстрее на маленьких батчах
+    dnn_batch_size = 1
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self._run = None
+
+    @property
+    def run(self):
+        if self._run is None:
+            try:
+                import onnxruntime
+            except ImportError:
+                self._run = self._dnn_runner()
+            else:
+                session = onnxruntime.InferenceSession(self.model_path, providers=['CPUExecutionProvider'])
+                input_name = session.get_inputs()[0].name
+                self._run = lambda batch: session.run(None, {input_name: batch})[0]
+        return self._run
+
+    def _dnn_runner(self):
+        import cv2
+        net = cv2.dnn.readNetFromONNX(self.model_path)
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+        def run(batch):
+            preds = []
+            for start in range(0, len(batch), self.dnn_batch_size):
+                net.setInput(batch[start:start + self.dnn_batch_size])
+                preds.append(net.forward())
+            return np.concatenate(preds)
+        return run
+
+    def predict(self, array, batch_size):
+        if array.ndim == 3:
+            # Экспортированная модель ждёт NHWC с одним каналом
+            array = array[..., np.newaxis]
+        preds = [
+            self.run(np.ascontiguousarray(array[start:start + batch_size]))
+            for start in range(0, len(array), batch_size)
+        ]
+        return np.concatenate(preds).reshape(len(array), -1)
+
+
+backends = {
+    'keras': KerasBackend,
+    'onnx': OnnxBackend
+}
+
+
+def onnx_path(model_path):
+    return os.path.splitext(model_path)[0] + '.onnx'
+
+
+def create_backend(name, model_path):
+    '''
+    Keras model path is kept as the single model setting,
+    the onnx backend picks the exported file next to it
+    '''
+    if name not in backends:
+        raise ValueError(f'Unknown backend {name}')
+    if name == 'onnx' and not model_path.endswith('.onnx'):
+        model_path = onnx_path(model_path)
+    return backends[name](model_path)
+
+
+def export_onnx(model_path, output_path=None, opset=13):
+    '''
+    One-off conversion of a Keras model, needs tensorflow and tf2onnx
+    '''
+    import tensorflow as tf
+    import tf2onnx
+
+    output_path = output_path or onnx_path(model_path)
+    model = tf.keras.models.load_model(model_path)
+    spec = (tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=output_path)
+    return output_path
+
+
+if __name__ == '__main__':
+    print(export_onnx(*sys.argv[1:3]))
@@ -1,5 +1,16 @@
+import json
+import os
 import numpy as np
 import pandas as pd
+from app.source.utils.files import atomic_open
+
+
+def char_codes(answers) -> np.ndarray:
+    '''
+    Answers as a matrix of character codes, shorter answers are padded with 0
+    '''
+    array = np.array(list(answers), dtype=str)
+    return array.view(np.uint32).reshape(len(array), array.dtype.itemsize // 4)
 
 
 class Problem:
@@ -16,11 +27,41 @@ class Problem:
         raise NotImplementedError(
             'can\'t evaluate share for this problem type')
 
+    def evaluate_many(self, evl_answers) -> np.ndarray:
+        return np.array([self.evaluate(ans) for ans in evl_answers], dtype=int)
+
+    def fingerprint(self) -> str:
+        '''
+        Everything the score of an answer depends on besides the answer itself
+        '''
+        return f'{type(self).__name__}:{self.ref_ans}:{self.max_pts}'
+
 
 class SortProblem(Problem):
     def __init__(self, ref_ans: str, max_pts: int, min_share: float = 0.5) -> None:
         super().__init__(ref_ans, max_pts)
         self.min_share = min_share
+        self.ref_pairs = self.get_pairs_from_array(ref_ans)
+        self._letters = sorted(set(ref_ans))
+        letter_index = {letter: i for i, letter in enumerate(self._letters)}
+        self._pair_index = np.array(
+            [(letter_index[a], letter_index[b]) for a, b in sorted(self.ref_pairs)],
+            dtype=int
+        ).reshape(-1, 2)
+
+    @staticmethod
+    def get_pairs_from_array(array) -> set:
+        '''
+        Pairs of different letters which occur only in one order
+        '''
+        first, last = {}, {}
+        for pos, letter in enumerate(array):
+            first.setdefault(letter, pos)
+            last[letter] = pos
+        return {
+            (a, b) for a in first for b in first
+            if a != b and first[a] < last[b] and not first[b] < last[a]
+        }
 
     def evaluate_share(self, evl_ans: str) -> int:
         '''
@@ -30,45 +71,109 @@ class SortProblem(Problem):
             raise ValueError(
                 'Evaluated answer is longer that reference answer')
 
-        def get_pairs_from_array(array: np.ndarray) -> set:
-            pairs = set()
-            for i in range(len(array)):
-                for j in range(i+1, len(array)):
-                    pairs.add((array[i], array[j]))
-            for a, b in pairs.copy():
-                if a == b:
-                    pairs.remove((a, b))
-                if (b, a) in pairs:
-                    pairs.remove((a, b))
-                    pairs.remove((b, a))
-            return pairs
+        evl_pairs = self.get_pairs_from_array(evl_ans)
 
-        evl_pairs = get_pairs_from_array(evl_ans)
-        ref_pairs = get_pairs_from_array(self.ref_ans)
-
-        correct_share = len(evl_pairs & ref_pairs) / len(ref_pairs)
+        correct_share = len(evl_pairs & self.ref_pairs) / len(self.ref_pairs)
 
         return correct_share
 
+    def evaluate_share_many(self, evl_answers) -> np.ndarray:
+        '''
+        Evaluate share of correct pairs for a column of answers at once
+        '''
+        codes = char_codes(evl_answers)
+        width = codes.shape[1]
+        if width > len(self.ref_ans):
+            raise ValueError(
+                'Evaluated answer is longer that reference answer')
+
+        if len(self.ref_pairs) == 0 and len(codes):
+            # как и evaluate: в эталоне нет пар разных букв
+            raise ZeroDivisionError('reference answer has no pairs of different letters')
+
+        letters = np.array([ord(letter) for letter in self._letters], dtype=np.uint32)
+        hits = codes[:, None, :] == letters[None, :, None]
+        present = hits.any(axis=2)
+        first = np.where(present, hits.argmax(axis=2), width)
+        last = np.where(present, width - 1 - hits[:, :, ::-1].argmax(axis=2), -1)
+
+        a, b = self._pair_index[:, 0], self._pair_index[:, 1]
+        correct = (first[:, a] < last[:, b]) & ~(first[:, b] < last[:, a])
+        return correct.sum(axis=1) / len(self.ref_pairs)
+
+    def evaluate_many(self, evl_answers) -> np.ndarray:
+        pts = (self.evaluate_share_many(evl_answers) - self.min_share) / (1 - self.min_share) * self.max_pts
+        return np.round(np.maximum(pts, 0)).astype(int)
+
+    def fingerprint(self) -> str:
+        return f'{super().fingerprint()}:{self.min_share}'
+
 
 class MatchProblem(Problem):
     def __init__(self, ref_ans: str, max_pts: int) -> None:
         super().__init__(ref_ans, max_pts)
-        self.ref_ans_table = pd.DataFrame(index=sorted(set(ref_ans)),
-                                          columns=range(len(ref_ans)),
-                                          data=0)
-        for pos, letter in enumerate(self.ref_ans):
-            self.ref_ans_table.loc[letter, pos] = 1
+        self._ref_codes = char_codes([ref_ans])[0]
+        self._ref_pts = self.evaluate_pts(ref_ans)
+
+    @property
+    def ref_ans_table(self) -> pd.DataFrame:
+        letters = sorted(set(self.ref_ans))
+        letter_codes = char_codes(letters)
+        return pd.DataFrame(index=letters,
+                            columns=range(len(self.ref_ans)),
+                            data=(letter_codes == self._ref_codes).astype(int))
 
     def evaluate_pts(self, evl_ans: str) -> int:
-        pts = 0
-        for pos, letter in enumerate(evl_ans):
-            if letter in self.ref_ans_table.index:
-                pts += self.ref_ans_table.loc[letter, pos]
-        return pts
+        if len(evl_ans) > len(self.ref_ans):
+            raise ValueError(
+                'Evaluated answer is longer that reference answer')
+        return sum(a == b for a, b in zip(evl_ans, self.ref_ans))
 
     def evaluate(self, evl_ans: str) -> int:
-        return round(self.evaluate_pts(evl_ans)/self.evaluate_pts(self.ref_ans) * self.max_pts)
+        return round(self.evaluate_pts(evl_ans)/self._ref_pts * self.max_pts)
+
+    def evaluate_many(self, evl_answers) -> np.ndarray:
+        codes = char_codes(evl_answers)
+        width = codes.shape[1]
+        if width > len(self.ref_ans):
+            raise ValueError(
+                'Evaluated answer is longer that reference answer')
+        if self._ref_pts == 0 and len(codes):
+            raise ZeroDivisionError('reference answer is empty')
+        pts = (codes == self._ref_codes[:width]).sum(axis=1)
+        return np.round(pts / self._ref_pts * self.max_pts).astype(int)
+
+
+class GradingCache:
+    '''
+    Scores of graded cells, stored per column together with the fingerprint
+    of the problem they were graded with
+    '''
+
+    def __init__(self, columns: dict = None) -> None:
+        self.columns = columns if columns is not None else {}
+        self.reused = 0
+        self.graded = 0
+
+    @classmethod
+    def load(cls, path: str):
+        if not os.path.isfile(path):
+            return cls()
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def save(self, path: str) -> None:
+        with atomic_open(path) as f:
+            json.dump(self.columns, f)
+
+    def lookup(self, column: str, fingerprint: str) -> dict:
+        entry = self.columns.get(column)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return {}
+        return entry['rows']
+
+    def update(self, column: str, fingerprint: str, rows: dict) -> None:
+        self.columns[column] = {'fingerprint': fingerprint, 'rows': rows}
 
 
 class Evaluator:
@@ -83,10 +188,43 @@ class Evaluator:
             pts_list.append(pr.evaluate(ans.strip(' ')))
         return pts_list
 
-    def eval_table(self, evl_table: pd.DataFrame) -> pd.DataFrame:
-        pts_table = evl_table.copy()
-        for row_index in range(pts_table.shape[0]):
-            ans = evl_table.iloc[row_index][-len(self.problem_list):]
-            pts_table.iloc[row_index, -
-                           len(self.problem_list):] = self.eval_list(ans)
-        return pts_table
+    def eval_table(self, evl_table: pd.DataFrame, cache: GradingCache = None) -> pd.DataFrame:
+        '''
+        Grade every problem column at once, answers are in the last columns.
+        With cache only cells whose answer or problem changed since the
+        previous run are graded, rows are matched by the table index
+        '''
+        count = len(self.problem_list)
+        keys = [str(key) for key in evl_table.index]
+        pts_columns = []
+        for idx, pr in enumerate(self.problem_list):
+            answers = [ans.strip(' ') for ans in evl_table.iloc[:, idx - count]]
+            if cache is None:
+                pts_columns.append(pr.evaluate_many(answers))
+            else:
+                column = str(evl_table.columns[idx - count])
+                pts_columns.append(self._eval_column_cached(pr, column, keys, answers, cache))
+        pts_table = pd.DataFrame(np.column_stack(pts_columns),
+                                 index=evl_table.index,
+                                 columns=evl_table.columns[-count:])
+        return pd.concat([evl_table.iloc[:, :-count], pts_table], axis=1)
+
+    def _eval_column_cached(self, pr: Problem, column: str, keys: list, answers: list, cache: GradingCache) -> np.ndarray:
+        fingerprint = pr.fingerprint()
+        cached = cache.lookup(column, fingerprint)
+        pts = np.zeros(len(answers), dtype=int)
+        stale = []
+        for idx, (key, ans) in enumerate(zip(keys, answers)):
+            hit = cached.get(key)
+            if hit is not None and hit[0] == ans:
+                pts[idx] = hit[1]
+            else:
+                stale.append(idx)
+        if stale:
+            pts[stale] = pr.evaluate_many([answers[idx] for idx in stale])
+        cache.reused += len(answers) - len(stale)
+        cache.graded += len(stale)
+        cache.update(column, fingerprint, {
+            key: [ans, int(p)] for key, ans, p in zip(keys, answers, pts)
+        })
+        return pts
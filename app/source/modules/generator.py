@@ -4,6 +4,7 @@ import json
 import os
 
 from app.source.utils.config import config
+from app.source.utils.parallel import ordered_map
 
 
 class Blank:
@@ -131,13 +132,24 @@ class Qr:
         self.pos = pos
         self.key = key
 
-    def draw(self, drawer: graphics.Drawer) -> None:
+    def data(self) -> str:
+        return f'{self.pos}|{self.key}'
+
+    def draw(self, drawer: graphics.Drawer, patch=None) -> None:
         drawer.qr(
             coords=config.qr.coords[self.pos],
-            data=f'{self.pos}|{self.key}'
+            data=self.data(),
+            patch=patch
         )
 
 
+def qr_patches(key) -> list:
+    '''
+    Render all qr codes of one code, runs in pool workers
+    '''
+    return [graphics.Drawer.QR.create(Qr(pos, key).data()) for pos in config.qr.coords.keys()]
+
+
 class Codes:
     def __init__(self, key) -> None:
         self.key = CodeKey(key)
@@ -151,10 +163,12 @@ class Codes:
             ])
         return codes
 
-    def draw(self, drawer: graphics.Drawer) -> None:
+    def draw(self, drawer: graphics.Drawer, qr_patches=None) -> None:
         self.key.draw(drawer)
-        for qr in self.qrs:
-            qr.draw(drawer)
+        if qr_patches is None:
+            qr_patches = [None] * len(self.qrs)
+        for qr, patch in zip(self.qrs, qr_patches):
+            qr.draw(drawer, patch)
 
     def dump() -> dict():
         return config.qr.coords
@@ -170,21 +184,48 @@ class BlankGenerator:
             Section(num, desc) for num, desc in enumerate(description['Sections'])
         ]
         self.keys = Codes.key_gen(description['Codes'])
+        self.key_prefixes = {
+            key: prefix
+            for prefix, count in description['Codes'].items()
+            for key in Codes.key_gen({prefix: count})
+        }
         self.codes = [
             Codes(key) for key in self.keys
         ]
+        self._template_ready = False
 
-    def draw(self):
+    def draw_template(self):
+        if self._template_ready:
+            return
         for section in self.sections:
             section.draw(
                 drawer=graphics.Drawer(self.blank.canvas)
             )
-        for code in self.codes:
+        self._template_ready = True
+
+    def iter_blanks(self, jobs=1):
+        '''
+        Yield (key, blank) for every code. The shared template is drawn once,
+        qr codes are rendered on a process pool and stamped into its copies
+        '''
+        self.draw_template()
+        patches = ordered_map(qr_patches, self.keys, jobs=jobs)
+        for code, code_patches in zip(self.codes, patches):
             new_blank = self.blank.copy()
             code.draw(
-                drawer=graphics.Drawer(new_blank.canvas)
+                drawer=graphics.Drawer(new_blank.canvas),
+                qr_patches=code_patches
             )
-            new_blank.save(os.path.join(self.path, 'blanks', code.key.key))
+            yield code.key.key, new_blank
+
+    def draw(self, jobs=1):
+        '''
+        Save every blank as png into blanks/ of the set, the set pdf is made by SetManager
+        '''
+        blanks_path = os.path.join(self.path, 'blanks')
+        os.makedirs(blanks_path, exist_ok=True)
+        for key, blank in self.iter_blanks(jobs=jobs):
+            blank.save(os.path.join(blanks_path, key))
 
     def dump(self):
         with open(os.path.join(self.path, 'generator_data.json'), 'w') as f:
@@ -198,6 +239,6 @@ class BlankGenerator:
                 sort_keys=True
             )
 
-    def generate(self):
-        self.draw()
+    def generate(self, jobs=1):
+        self.draw(jobs=jobs)
         self.dump()
@@ -1,10 +1,14 @@
 # Импортируем необходимые библиотеки
 import json
+import hashlib
 import cv2
 import numpy as np
-import pandas as pd
-from keras.models import load_model
 import os
+from functools import partial
+from app.source.utils.parallel import ordered_map
+from app.source.utils.files import atomic_open
+from app.source.utils.metrics import metrics
+from app.source.modules.backends import create_backend
 
 # Класс для обработки изображения
 class ImageProcessor:
@@ -24,117 +28,554 @@ class ImageProcessor:
         )
 
     @staticmethod
-    def contours_from_roi(roi):
-        gray_img = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-        _, binary_img = cv2.threshold(
-            gray_img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    def to_gray(image):
+        if image.ndim == 3:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+
+    @staticmethod
+    def page_contours(gray_img, region):
+        '''
+        Binarize the answer region (x1, y1, x2, y2) of the page once and find all
+        its contours, bounding rects are returned in page coordinates
+        '''
+        x1, y1, x2, y2 = region
+        _, ink_img = cv2.threshold(
+            gray_img[y1:y2, x1:x2], 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
         contours, _ = cv2.findContours(
-            binary_img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        return contours
+            ink_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        rects = np.array([cv2.boundingRect(c) for c in contours], dtype=np.int32).reshape(-1, 4)
+        # outer ink border lies one pixel inside the paper border the per-cell search traced.
+        # Exact on clean pages only: on distorted scans the region wide Otsu threshold
+        # may differ from the per-cell one and shift some rects (and so the crops) by a pixel
+        rects += (x1 - 1, y1 - 1, 2, 2)
+        return contours, rects
+
+    @staticmethod
+    def match_boxes(boxes, deltas, contours, rects):
+        '''
+        For every box (x1, y1, x2, y2) find the contour inside the box window widened
+        by delta whose area is the nearest one above the box area.
+        Returns contour indices, None for boxes without such contour
+        '''
+        box_areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        x, y, w, h = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+        candidates = (
+            (x[None, :] >= (boxes[:, 0] - deltas)[:, None]) &
+            (y[None, :] >= (boxes[:, 1] - deltas)[:, None]) &
+            ((x + w)[None, :] <= (boxes[:, 2] + deltas)[:, None]) &
+            ((y + h)[None, :] <= (boxes[:, 3] + deltas)[:, None]) &
+            ((w * h)[None, :] > box_areas[:, None])
+        )
+        areas = {}
+        matches = []
+        for box_area, box_candidates in zip(box_areas, candidates):
+            min_diff = float('inf')
+            nearest = None
+            for idx in np.flatnonzero(box_candidates):
+                if idx not in areas:
+                    areas[idx] = cv2.contourArea(contours[idx])
+                diff = abs(areas[idx] - box_area)
+                if diff < min_diff and areas[idx] > box_area:
+                    min_diff = diff
+                    nearest = idx
+            matches.append(nearest)
+        return matches
+
+    @staticmethod
+    def warp_region(image, M, region):
+        '''
+        Warp only the region (x1, y1, x2, y2) of the page aligned by M, the same
+        pixels as cropping the fully warped page. Returns the crop and its origin
+        '''
+        height, width = image.shape[:2]
+        x1, y1 = max(region[0], 0), max(region[1], 0)
+        x2, y2 = min(region[2], width), min(region[3], height)
+        if M is None:
+            return image[y1:y2, x1:x2], (x1, y1)
+        shifted = np.float64(M).copy()
+        shifted[:, 2] -= (x1, y1)
+        with metrics.stage('warp'):
+            return cv2.warpAffine(image, shifted, (x2 - x1, y2 - y1), flags=cv2.INTER_LINEAR), (x1, y1)
+
+    @staticmethod
+    def prepare_roi_for_recognition(roi):
+        dilated_img = cv2.erode(
+            src=roi,
+            kernel=np.ones((2, 2), np.uint8),
+            iterations=1
+        )
+        square_img = cv2.bitwise_not(ImageProcessor.to_gray(dilated_img))
+        return square_img.astype("float32") / 255.0
+
+
+class RecognitionPlan:
+    '''
+    Layout from generator_data.json compiled once into flat arrays:
+    int32 box table (x1, y1, x2, y2) and parallel (section, question, cell) ids
+    '''
+
+    def __init__(self, ref_coords):
+        ids, boxes, thicknesses = [], [], []
+        for section_idx, section in enumerate(ref_coords['Sections']):
+            for question_idx, question in enumerate(section['Questions']):
+                for idx, box in enumerate(question['Cells']):
+                    ids.append((section_idx, question_idx, idx))
+                    boxes.append(ImageProcessor.get_corners_from_box(box))
+                    thicknesses.append(question['Metadata']['thickness'])
+        self.index = np.array(ids, dtype=np.int32).reshape(-1, 3)
+        self.boxes = np.array(boxes, dtype=np.int32).reshape(-1, 4)
+        thicknesses = np.array(thicknesses, dtype=np.int32)
+        self.deltas = 3 * thicknesses
+        self.crop_deltas = -2 * thicknesses
+        self.region = (0, 0, 0, 0)
+        if len(self.boxes):
+            self.region = (
+                max(int((self.boxes[:, 0] - self.deltas).min()), 0),
+                max(int((self.boxes[:, 1] - self.deltas).min()), 0),
+                int((self.boxes[:, 2] + self.deltas).max()),
+                int((self.boxes[:, 3] + self.deltas).max())
+            )
+
+        # question columns: (section_idx, question_idx, first cell, last cell + 1)
+        self.questions = []
+        for pos, (section_idx, question_idx, _) in enumerate(self.index.tolist()):
+            if self.questions and self.questions[-1][:2] == [section_idx, question_idx]:
+                self.questions[-1][3] = pos + 1
+            else:
+                self.questions.append([section_idx, question_idx, pos, pos + 1])
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def fingerprint(self):
+        digest = hashlib.sha1()
+        for array in (self.index, self.boxes, self.deltas, self.crop_deltas):
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+
+def extract_cells(canvas, plan, origin=(0, 0)):
+    '''
+    Prepare all cells of the page by the plan. canvas may be only a part of the
+    page with its top left corner at origin, it must cover the plan region.
+    Returns float32 rois (cells, 32, 32) and mask of cells whose box was found
+    '''
+    rois = np.zeros((len(plan), 32, 32), dtype=np.float32)
+    found = np.zeros(len(plan), dtype=bool)
+    if len(plan) == 0:
+        return rois, found
+    gray_img = ImageProcessor.to_gray(canvas)
+    ox, oy = origin
+    x0, y0, x1, y1 = plan.region
+    region = (x0 - ox, y0 - oy, x1 - ox, y1 - oy)
+    with metrics.stage('contour_search', items=len(plan)):
+        contours, rects = ImageProcessor.page_contours(gray_img, region)
+        rects += (ox, oy, 0, 0)
+        matches = ImageProcessor.match_boxes(plan.boxes, plan.deltas, contours, rects)
+
+    with metrics.stage('roi_prep', items=len(plan)):
+        prepared_img = ImageProcessor.prepare_roi_for_recognition(
+            gray_img[region[1]:region[3], region[0]:region[2]])
+        rects = (rects - (x0, y0, 0, 0)).tolist()
+
+        for idx, (crop_delta, match) in enumerate(zip(plan.crop_deltas.tolist(), matches)):
+            if match is not None:
+                rois[idx] = cv2.resize(
+                    ImageProcessor.roi_by_wh(
+                        canvas=prepared_img,
+                        corner_wh=rects[match],
+                        delta=crop_delta
+                    ),
+                    (32, 32)
+                )
+                found[idx] = True
+    return rois, found
+
+
+def matrix_path(image_path):
+    '''
+    Affine matrix stored by restore next to the raw (not warped) scan
+    '''
+    return os.path.splitext(image_path)[0] + '.npy'
+
+
+def scan_paths(folder_path):
+    '''
+    Scans to recognize in the folder: pages without codes (Fail_N)
+    and stored matrices are skipped
+    '''
+    return [
+        os.path.join(folder_path, image_name)
+        for image_name in os.listdir(folder_path)
+        if not image_name.startswith("Fail_") and not image_name.endswith('.npy')
+    ]
+
+
+def read_page(image_path, plan):
+    '''
+    Load scan and prepare all its cells, runs in pool workers.
+    Raw scans with a stored matrix are warped only in the plan region
+    '''
+    with metrics.stage('imread'):
+        canvas = ImageProcessor.to_gray(cv2.imread(image_path, cv2.IMREAD_ANYCOLOR))
+    code = os.path.splitext(os.path.basename(image_path))[0]
+    origin = (0, 0)
+    if os.path.isfile(matrix_path(image_path)):
+        canvas, origin = ImageProcessor.warp_region(canvas, np.load(matrix_path(image_path)), plan.region)
+    return (code, *extract_cells(canvas, plan, origin))
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def scan_hash(image_path):
+    '''
+    Hash of the scan together with its stored matrix
+    '''
+    digest = file_hash(image_path)
+    if os.path.isfile(matrix_path(image_path)):
+        digest += file_hash(matrix_path(image_path))
+    return digest
+
 
 class AnswerRecognizer:
-    def __init__(self, model_path):
-        self._model = load_model(model_path)
+    batch_size = 256
+
+    def __init__(self, model_path, backend='keras'):
+        self.model_path = model_path
+        self.backend = create_backend(backend, model_path)
         self.label_names = "ABCDEFGHIJKLM_"
 
     def recognize(self, processed_roi):
-        array = np.array([processed_roi], dtype="float32")
-        pred = self._model.predict(array)[0]
+        return self.recognize_batch([processed_roi])[0]
+
+    def fingerprint(self):
+        '''
+        Backend and content of the model file it runs
+        '''
+        path = self.backend.model_path
+        if os.path.isfile(path):
+            return f'{type(self.backend).__name__}:{file_hash(path)}'
+        return f'{type(self.backend).__name__}:{path}'
+
+    def classify(self, processed_rois):
+        '''
+        Classify all rois with a single predict call, returns label indices and confidences
+        '''
+        if len(processed_rois) == 0:
+            return np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.float32)
+        array = np.asarray(processed_rois, dtype="float32")
+        with metrics.stage('predict', items=len(array)):
+            preds = self.backend.predict(array, batch_size=self.batch_size)
+        return np.argmax(preds, axis=1).astype(np.int8), np.max(preds, axis=1).astype(np.float32)
+
+    def recognize_batch(self, processed_rois):
+        labels, confidences = self.classify(processed_rois)
+        return [
+            {
+                'pred': round(float(conf), 2),
+                'ans': self.label_names[label]
+            } for label, conf in zip(labels, confidences)
+        ]
+
+
+class RecognitionResults:
+    '''
+    Recognized labels (-1 when the cell was not found) and confidences
+    of every page, one preallocated row per code
+    '''
+
+    def __init__(self, plan, label_names, capacity=0):
+        self.plan = plan
+        self.label_names = label_names
+        self.codes = []
+        self._rows = {}
+        self.labels = np.full((capacity, len(plan)), -1, dtype=np.int8)
+        self.preds = np.zeros((capacity, len(plan)), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def reserve(self, capacity):
+        if capacity <= len(self.labels):
+            return
+        labels = np.full((capacity, len(self.plan)), -1, dtype=np.int8)
+        preds = np.zeros((capacity, len(self.plan)), dtype=np.float32)
+        labels[:len(self.labels)] = self.labels
+        preds[:len(self.preds)] = self.preds
+        self.labels, self.preds = labels, preds
+
+    def row(self, code):
+        if code not in self._rows:
+            if len(self.codes) == len(self.labels):
+                self.reserve(max(2 * len(self.labels), 1))
+            self._rows[code] = len(self.codes)
+            self.codes.append(code)
+        return self._rows[code]
+
+    def cell(self, row, idx):
+        label = self.labels[row, idx]
+        if label < 0:
+            return {"pred": 0, "ans": "N/A"}
+        return {'pred': round(float(self.preds[row, idx]), 2), 'ans': self.label_names[label]}
+
+    def to_dict(self):
+        data = {}
+        for row, code in enumerate(self.codes):
+            sections = data[code] = {}
+            for idx, (section_idx, question_idx, cell_idx) in enumerate(self.plan.index.tolist()):
+                questions = sections.setdefault(f"Section_{section_idx+1}", {})
+                cells = questions.setdefault(f"Question_{question_idx+1}", {})
+                cells[f"Cell_{cell_idx+1}"] = self.cell(row, idx)
+        return data
+
+    def to_frame(self):
+        import pandas as pd
+
+        # label -1 (cell not found) picks the trailing '_'
+        letters = np.array(list(self.label_names + '_'))
+        answers = letters[self.labels[:len(self.codes)]]
+        df_data = {}
+        for section_idx, question_idx, start, stop in self.plan.questions:
+            df_data[f"S{section_idx+1}Q{question_idx+1}"] = [''.join(row) for row in answers[:, start:stop]]
+        return pd.DataFrame(df_data, index=self.codes)
+
+
+class RecognitionCache:
+    '''
+    Labels and confidences of every recognized scan keyed by the hash of the
+    scan file, valid only for the layout and model fingerprint they were made with
+    '''
+
+    def __init__(self, fingerprint, entries=None):
+        self.fingerprint = fingerprint
+        self.entries = entries if entries is not None else {}
+        self.used = {}
+        self.reused = 0
+        self.recognized = 0
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        if not os.path.isfile(path):
+            return cls(fingerprint)
+        with np.load(path) as data:
+            if str(data['fingerprint']) != fingerprint:
+                return cls(fingerprint)
+            entries = dict(zip(data['keys'].tolist(), zip(data['labels'], data['preds'])))
+        return cls(fingerprint, entries)
+
+    def save(self, path, n_cells):
+        '''
+        Only scans seen in this run are kept, n_cells is the cell count of the plan
+        '''
+        keys = list(self.used)
+        labels = [self.used[key][0] for key in keys]
+        preds = [self.used[key][1] for key in keys]
+        with atomic_open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                fingerprint=self.fingerprint,
+                keys=np.array(keys, dtype=str),
+                labels=np.array(labels, dtype=np.int8).reshape(len(keys), n_cells),
+                preds=np.array(preds, dtype=np.float32).reshape(len(keys), n_cells)
+            )
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.reused += 1
+            self.used[key] = entry
+        return entry
+
+    def update(self, key, labels, preds):
+        self.recognized += 1
+        self.used[key] = self.entries[key] = (labels.copy(), preds.copy())
+
+
+class ReviewQueue:
+    '''
+    Cells recognized with confidence below the threshold (and cells not found)
+    together with their 32x32 crops, pages without such cells need no second pass
+    '''
+
+    def __init__(self, plan, label_names, threshold):
+        self.plan = plan
+        self.label_names = label_names
+        self.threshold = threshold
+        self.pages = 0
+        self.codes, self.cells, self.labels, self.preds, self.crops = [], [], [], [], []
+
+    def __len__(self):
+        return sum(len(cells) for cells in self.cells)
+
+    def add(self, code, labels, preds, rois):
+        self.pages += 1
+        cells = np.flatnonzero(preds < self.threshold)
+        if len(cells) == 0:
+            return
+        self.codes.append(np.full(len(cells), code))
+        self.cells.append(cells.astype(np.int32))
+        self.labels.append(labels[cells])
+        self.preds.append(preds[cells])
+        self.crops.append(np.round(rois[cells] * 255).astype(np.uint8))
+
+    def get_stats(self):
         return {
-            'pred': round(float(np.max(pred)), 2),
-            'ans': self.label_names[np.argmax(pred)]
+            'threshold': self.threshold,
+            'pages': self.pages,
+            'pages_to_review': len(self.codes),
+            'cells_to_review': len(self)
         }
 
+    def save(self, path):
+        '''
+        Crops and labels go to review.npz, the readable list to review.json
+        '''
+        def stack(arrays, shape=(), dtype=np.int32):
+            return np.concatenate(arrays) if arrays else np.zeros((0, *shape), dtype=dtype)
+
+        codes = stack(self.codes, dtype=str)
+        cells = stack(self.cells)
+        labels = stack(self.labels, dtype=np.int8)
+        preds = stack(self.preds, dtype=np.float32)
+        index = self.plan.index[cells]
+        np.savez_compressed(
+            os.path.join(path, 'review.npz'),
+            codes=codes, cells=cells, index=index,
+            labels=labels, preds=preds,
+            crops=stack(self.crops, (32, 32), np.uint8)
+        )
+        letters = self.label_names + '_'
+        queue = [
+            {
+                'code': str(code),
+                'question': f"S{section_idx+1}Q{question_idx+1}",
+                'cell': int(cell_idx) + 1,
+                'ans': letters[label] if label >= 0 else 'N/A',
+                'pred': round(float(pred), 2)
+            } for code, (section_idx, question_idx, cell_idx), label, pred
+            in zip(codes, index.tolist(), labels.tolist(), preds)
+        ]
+        with open(os.path.join(path, 'review.json'), 'w') as f:
+            json.dump({**self.get_stats(), 'cells': queue}, f, indent=4)
+
+
 class BlankReader:
-    def __init__(self, path, info_file='generator_data.json', model='app/model/AM_50.model'):
+    def __init__(self, path, info_file='generator_data.json', model='app/model/AM_50.model', pages_per_batch=1, backend='keras',
+                 review_threshold=None):
         info_file = os.path.join(path, info_file)
         with open(info_file, 'r') as f:
             self._ref_coords = json.load(f)
-        self.recognized_data = {}
-        self.answer_recognizer = AnswerRecognizer(model)
-
-    def find_nearest_contour(self, box, contours):
-        x1, y1, x2, y2 = box[0][0], box[0][1], box[1][0], box[1][1]
-        contour_area = (x2 - x1) * (y2 - y1)
-        min_diff = float('inf')
-        nearest_contour = None
-        for c in contours:
-            area = cv2.contourArea(c)
-            diff = abs(area - contour_area)
-            if diff < min_diff and area > contour_area:
-                min_diff = diff
-                nearest_contour = c
-        return nearest_contour
-
-    def prepare_roi_for_recognition(self, roi):
-        dilated_img = cv2.erode(
-            src=roi,
-            kernel=np.ones((2, 2), np.uint8),
-            iterations=1
+        self.plan = RecognitionPlan(self._ref_coords)
+        self.answer_recognizer = AnswerRecognizer(model, backend)
+        self.results = RecognitionResults(self.plan, self.answer_recognizer.label_names)
+        self.review = None
+        if review_threshold is not None:
+            self.review = ReviewQueue(self.plan, self.answer_recognizer.label_names, review_threshold)
+        self.pages_per_batch = pages_per_batch
+        self._pending_cells = []
+        self._pending_pages = 0
+
+    @property
+    def recognized_data(self):
+        self.flush()
+        return self.results.to_dict()
+
+    def fingerprint(self):
+        return f'{self.plan.fingerprint()}:{self.answer_recognizer.fingerprint()}'
+
+    def recognize_answers_in_folder(self, folder_path, jobs=1, cache=None):
+        self.recognize_answers_in_files(scan_paths(folder_path), jobs=jobs, cache=cache)
+
+    def recognize_answers_in_files(self, image_paths, jobs=1, cache=None):
+        '''
+        With cache only new or changed scans are read and classified,
+        the rest take their results from the cache
+        '''
+        self.results.reserve(len(self.results) + len(image_paths))
+        keys = [None] * len(image_paths)
+        cached = [None] * len(image_paths)
+        if cache is not None:
+            keys = [scan_hash(image_path) for image_path in image_paths]
+            cached = [self._cached_entry(cache, key) for key in keys]
+        pages = ordered_map(
+            partial(read_page, plan=self.plan),
+            (image_path for image_path, entry in zip(image_paths, cached) if entry is None),
+            jobs=jobs
         )
-        square_img = cv2.bitwise_not(cv2.cvtColor(dilated_img, cv2.COLOR_BGR2GRAY))
-        return square_img.astype("float32") / 255.0
+        new_rows = []
+        for image_path, key, entry in zip(image_paths, keys, cached):
+            if entry is not None:
+                self._add_cached_page(image_path, *entry)
+                continue
+            print(image_path)
+            code, rois, found = next(pages)
+            self.add_page(code, rois, found)
+            new_rows.append((self.results.row(code), key))
+        pages.close()
+        self.flush()
+        if cache is not None:
+            for row, key in new_rows:
+                cache.update(key, self.results.labels[row], self.results.preds[row])
 
+    def _cached_entry(self, cache, key):
+        entry = cache.lookup(key)
+        # страницы с сомнительными ячейками перечитываем, чтобы получить вырезки для проверки
+        if entry is not None and self.review is not None and (entry[1] < self.review.threshold).any():
+            cache.reused -= 1
+            return None
+        return entry
 
-    def recognize_answers_in_folder(self, folder_path):
-        for image_name in os.listdir(folder_path):
-            if not image_name.startswith("Fail_"):
-                image_path = os.path.join(folder_path, image_name)
-                print(image_path)
-                self.recognize_answers(image_path)
-        
+    def _add_cached_page(self, image_path, labels, preds):
+        code = os.path.splitext(os.path.basename(image_path))[0]
+        row = self.results.row(code)
+        self.results.labels[row] = labels
+        self.results.preds[row] = preds
+        if self.review is not None:
+            self.review.add(code, labels, preds, None)
 
     def recognize_answers(self, image_path):
-        self._cur_canvas = cv2.imread(image_path)
-        self._cur_code = os.path.splitext(os.path.basename(image_path))[0]
-        self.recognized_data[self._cur_code] = {}
-        
-        for section_idx, section in enumerate(self._ref_coords['Sections']):
-            section_key = f"Section_{section_idx+1}"
-            self.recognized_data[self._cur_code][section_key] = {}
-            for question_idx, question in enumerate(section['Questions']):
-                question_key = f"Question_{question_idx+1}"
-                self.recognized_data[self._cur_code][section_key][question_key] = {}
-                for idx, box in enumerate(question['Cells']):
-                    box_key = f"Cell_{idx+1}"
-                    wide_roi = ImageProcessor.roi_by_corners(
-                        canvas=self._cur_canvas,
-                        corners=(box[0][0], box[0][1], box[1][0], box[1][1]), 
-                        delta=3 * question['Metadata']['thickness']
-                    )
-                    contours = ImageProcessor.contours_from_roi(wide_roi)
-                    nearest_contour = self.find_nearest_contour(box, contours)
-                    
-                    if nearest_contour is not None:
-                        processed_roi = self.prepare_roi_for_recognition(
-                            ImageProcessor.roi_by_wh(
-                                canvas=wide_roi,
-                                corner_wh=cv2.boundingRect(nearest_contour),
-                                delta=-int(question['Metadata']['thickness']*2)
-                            )
-                        )
-                        processed_roi = cv2.resize(processed_roi, (32, 32))
-                        self.recognized_data[self._cur_code][section_key][question_key][box_key] = self.answer_recognizer.recognize(processed_roi)
-                    else:
-                        self.recognized_data[self._cur_code][section_key][question_key][box_key] = {"pred": 0, "ans": "N/A"}
+        self.add_page(*read_page(image_path, self.plan))
 
-    def save_data(self, path):
-        with open(os.path.join(path, 'recognized.json'), 'w') as f:
-            json.dump(self.recognized_data, f, indent=4)
-        df_data = {}
-        
-        for code, sections in self.recognized_data.items():
-            df_data[code] = {}
-            for section_key, questions in sections.items():
-                section_number = section_key.split("_")[-1]
-                
-                for question_key, cells in questions.items():
-                    question_number = question_key.split("_")[-1] 
-                    column_name = f"S{section_number}Q{question_number}"
-                    
-                    answers = "".join(cells[cell_key]["ans"] if cells[cell_key]["ans"] != "N/A" else "_" for cell_key in sorted(cells.keys()))
-                    df_data[code][column_name] = answers
-
-        df = pd.DataFrame.from_dict(df_data, orient='index')
-        df.sort_index(ascending=True).to_csv(os.path.join(path, 'recognized.csv'), index_label='Code')
+    def add_page(self, code, rois, found):
+        row = self.results.row(code)
+        self.results.labels[row] = -1
+        self.results.preds[row] = 0
+        self._pending_cells.append((row, np.flatnonzero(found), rois))
+
+        self._pending_pages += 1
+        if self._pending_pages >= self.pages_per_batch:
+            self.flush()
 
+    def flush(self):
+        '''
+        Recognize all cells collected from the pending pages in one batch
+        '''
+        if not self._pending_cells:
+            return
+        labels, preds = self.answer_recognizer.classify(
+            np.concatenate([rois[cells] for _, cells, rois in self._pending_cells])
+        )
+        start = 0
+        for row, cells, rois in self._pending_cells:
+            self.results.labels[row, cells] = labels[start:start + len(cells)]
+            self.results.preds[row, cells] = preds[start:start + len(cells)]
+            start += len(cells)
+            if self.review is not None:
+                self.review.add(self.results.codes[row], self.results.labels[row], self.results.preds[row], rois)
+        self._pending_cells = []
+        self._pending_pages = 0
+
+    def save_data(self, path):
+        self.flush()
+        with metrics.stage('csv_write', items=len(self.results)):
+            with atomic_open(os.path.join(path, 'recognized.json')) as f:
+                json.dump(self.results.to_dict(), f, indent=4)
+            df = self.results.to_frame()
+            with atomic_open(os.path.join(path, 'recognized.csv')) as f:
+                df.sort_index(ascending=True).to_csv(f, index_label='Code')
+        if self.review is not None:
+            self.review.save(path)
@@ -1,63 +1,361 @@
 import cv2
 import numpy as np
 import json
+import time
+from functools import partial
 from app.source.utils.config import config
+from app.source.utils.parallel import ordered_map
+from app.source.utils.metrics import metrics
+from app.source.modules.reader import ImageProcessor, RecognitionPlan, extract_cells, matrix_path
 import os
+import re
+
+FAIL_NAME = re.compile(r'Fail_(\d+)\.')
+
+
+def get_image(src_image, grayscale=True):
+    if isinstance(src_image, np.ndarray):
+        image = src_image
+        if grayscale and image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    elif grayscale:
+        image = np.asarray(src_image.convert('L'))
+    elif src_image.mode == 'L':
+        image = cv2.cvtColor(np.asarray(src_image), cv2.COLOR_GRAY2BGR)
+    else:
+        image = cv2.cvtColor(np.asarray(src_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+    return cv2.resize(image, (config.page.width, config.page.height))
+
+
+def detect_qr_in_corners(image, ref_coords):
+    '''
+    Look for every qr code only in a padded window around its printed position
+    '''
+    detector = cv2.QRCodeDetector()
+    pad = config.qr.search_padding
+    scale = config.qr.search_scale
+    data, points = [], []
+    for (x1, y1), (x2, y2) in ref_coords.values():
+        x0, y0 = max(x1 - pad, 0), max(y1 - pad, 0)
+        window = image[y0:y2 + pad, x0:x2 + pad]
+        if scale != 1:
+            window = cv2.resize(window, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        d, p, _ = detector.detectAndDecode(window)
+        if d and p is not None:
+            data.append(d)
+            points.append(p[0] / scale + np.float32([x0, y0]))
+    return data, points
+
+
+def detect_qr_in_page(image):
+    '''
+    Look for qr codes on the whole page, returns decoded data and points
+    '''
+    retval, data, points, _ = cv2.QRCodeDetector().detectAndDecodeMulti(image)
+    if not retval:
+        return [], []
+    return list(data), list(points)
+
+
+def detect_qr(image, ref_coords):
+    '''
+    Returns retval, decoded data, points and the search path used.
+    When some code is missing in the corner windows the whole page is searched
+    too, codes found by either search are merged by their position
+    '''
+    data, points = detect_qr_in_corners(image, ref_coords)
+    found = {d.split('|')[0] for d in data if '|' in d}
+    if len(found) == len(ref_coords):
+        return True, data, points, 'corners'
+    # поиск по всей странице может не найти код, который нашёлся в углу, и наоборот
+    for d, p in zip(*detect_qr_in_page(image)):
+        pos = d.split('|')[0] if '|' in d else None
+        if d and pos not in found:
+            data.append(d)
+            points.append(p)
+            if pos is not None:
+                found.add(pos)
+    return len(data) > 0, data, points, 'full'
+
+
+def qr_corner_pairs(corners, ref_coords):
+    '''
+    All four corners of every found qr code (tl, tr, br, bl as the detector
+    returns them) and their printed positions
+    '''
+    src_pts, dst_pts = [], []
+    for pos, p in corners.items():
+        (x1, y1), (x2, y2) = ref_coords[pos]
+        src_pts.extend(p)
+        dst_pts.extend([(x1, y1), (x2, y1), (x2, y2), (x1, y2)])
+    return np.float32(src_pts).reshape(-1, 2), np.float32(dst_pts).reshape(-1, 2)
+
+
+def match_box_grid(image, M, plan, widen=1):
+    '''
+    Warp the answer region by M and find the printed boxes around their places,
+    windows are widened by widen. Returns indices of matched boxes and
+    centers of their contours in page coordinates
+    '''
+    crop, (ox, oy) = ImageProcessor.warp_region(image, M, plan.region)
+    x0, y0, x1, y1 = plan.region
+    contours, rects = ImageProcessor.page_contours(crop, (x0 - ox, y0 - oy, x1 - ox, y1 - oy))
+    rects += (ox, oy, 0, 0)
+    matches = ImageProcessor.match_boxes(plan.boxes, plan.deltas * widen, contours, rects)
+    matched = [idx for idx, match in enumerate(matches) if match is not None]
+    rects = rects[[matches[idx] for idx in matched]].reshape(-1, 4)
+    return matched, rects[:, :2] + rects[:, 2:] / 2
+
+
+def recover_matrix(image, corners, ref_coords, plan):
+    '''
+    Alignment when one or two qr codes were found: rough affine by all corners of
+    the found codes (RANSAC), refined by the printed box grid of the answer region.
+    Returns the matrix or None if too few boxes were matched
+    '''
+    src_pts, dst_pts = qr_corner_pairs(corners, ref_coords)
+    M, _ = cv2.estimateAffine2D(src_pts, dst_pts, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if M is None or len(plan) == 0:
+        return None
+    box_centers = (plan.boxes[:, :2] + plan.boxes[:, 2:]) / 2
+    for widen in (config.qr.recovery_widen, 1):
+        matched, centers = match_box_grid(image, M, plan, widen)
+        if len(matched) < max(3, config.qr.recovery_min_share * len(plan)):
+            return None
+        # углы кодов тоже участвуют, иначе по одной строке ячеек поворот не определить
+        aligned_qr = cv2.transform(src_pts[None], M)[0]
+        C, _ = cv2.estimateAffine2D(
+            np.vstack([centers, aligned_qr]).astype(np.float32),
+            np.vstack([box_centers[matched], dst_pts]).astype(np.float32),
+            method=cv2.RANSAC,
+            ransacReprojThreshold=2.0
+        )
+        if C is None:
+            return None
+        M = np.vstack([C, [0, 0, 1]]) @ np.vstack([M, [0, 0, 1]])
+        M = M[:2]
+    matched, _ = match_box_grid(image, M, plan)
+    if len(matched) < config.qr.recovery_min_share * len(plan):
+        return None
+    return M
+
+
+def align_image(src_image, ref_coords, grayscale=True, plan=None):
+    '''
+    Find qr codes and the affine matrix aligning the page by them.
+    With plan pages with one or two codes are aligned by the answer boxes as well.
+    Returns image key (None if no codes were found), warning, the page
+    not yet warped, the matrix (None if it was not found), the qr search path used
+    and recovery result (None if it was not tried)
+    '''
+    image = get_image(src_image, grayscale)
+    with metrics.stage('qr_detect'):
+        retval, data, points, qr_search = detect_qr(image, ref_coords)
+    coords = {pos: None for pos in ref_coords.keys()}
+    corners = {}
+    image_key = "UNKNOWN"
+    warning = None
+    M = None
+    recovery = None
+
+    if retval:
+        for i, (d, p) in enumerate(zip(data, points)):
+            if '|' in d:
+                pos, image_key = d.split('|')
+                coords[pos] = [p[0], p[2]]
+                corners[pos] = p
+
+        found_codes = [key for key, value in coords.items() if value is not None]
+        num_found = len(found_codes)
+
+        if num_found == 3:
+            src_pts = np.float32([coords[pos][1] for pos in found_codes])
+            dst_pts = np.float32([ref_coords[pos][1] for pos in found_codes])
+            M = cv2.getAffineTransform(src_pts, dst_pts)
+
+        elif num_found == 2:
+            warning = "Only two QR codes found."
+
+        elif num_found == 1:
+            warning = "Only one QR code found."
+
+        if num_found in (1, 2) and plan is not None:
+            start = time.perf_counter()
+            with metrics.stage('qr_recovery'):
+                M = recover_matrix(image, corners, ref_coords, plan)
+            recovery = {'ok': M is not None, 'seconds': time.perf_counter() - start}
+            if M is not None:
+                warning = warning[:-1] + ", aligned by answer boxes."
+
+    else:
+        image_key = None
+
+    return {
+        'key': image_key,
+        'warning': warning,
+        'image': image,
+        'matrix': M,
+        'qr_search': qr_search,
+        'recovery': recovery
+    }
+
+
+def warp_page(image, M):
+    if M is None:
+        return image
+    with metrics.stage('warp'):
+        return cv2.warpAffine(image, M, (config.page.width, config.page.height), flags=cv2.INTER_LINEAR)
+
+
+def encode_png(image):
+    with metrics.stage('png_encode'):
+        return cv2.imencode('.png', image)[1]
+
+
+def align_page(src_image, ref_coords, grayscale=True, store_matrix=False, plan=None):
+    '''
+    Align the page and encode it to png, runs in pool workers.
+    With store_matrix the raw page is encoded and the matrix is kept instead of warping
+    '''
+    result = align_image(src_image, ref_coords, grayscale, plan)
+    image = result.pop('image')
+    if not store_matrix:
+        image = warp_page(image, result.pop('matrix'))
+    result['png'] = encode_png(image)
+    return result
+
+
+def align_and_extract(item, ref_coords, plan, grayscale=True, audit_every=0):
+    '''
+    Align the page and cut its cells right away, runs in pool workers.
+    item is (page index, image). Png is encoded only for pages without
+    codes, pages left unaligned and every audit_every-th page
+    '''
+    page_idx, src_image = item
+    result = align_image(src_image, ref_coords, grayscale, plan)
+    image, M = result.pop('image'), result.pop('matrix')
+    result['png'] = None
+    # страницу без выравнивания сохраняем, чтобы предупреждение можно было проверить
+    unaligned = result['warning'] is not None and M is None
+    if result['key'] is None or unaligned or (audit_every and page_idx % audit_every == 0):
+        image = warp_page(image, M)
+        result['png'] = encode_png(image)
+        origin = (0, 0)
+    else:
+        # для распознавания достаточно выровнять только область с ячейками
+        image, origin = ImageProcessor.warp_region(image, M, plan.region)
+    if result['key'] is not None:
+        result['rois'], result['found'] = extract_cells(image, plan, origin)
+    return result
+
 
 class BlankRestorer:
-    def __init__(self, set_path):
+    def __init__(self, set_path, grayscale=True, store_matrix=False):
+        self.grayscale = grayscale
+        self.store_matrix = store_matrix
         self.scans_path = os.path.join(set_path, 'scans')
-        os.mkdir(self.scans_path)
+        os.makedirs(self.scans_path, exist_ok=True)
         with open(os.path.join(set_path, 'generator_data.json'), 'r') as f:
-            self.ref_coords = json.load(f)['Codes']
-        self.fail_count = 0  
+            generator_data = json.load(f)
+        self.ref_coords = generator_data['Codes']
+        # сетка ячеек нужна, чтобы выровнять страницы с одним-двумя найденными кодами
+        self.plan = RecognitionPlan(generator_data)
+        # при повторном запуске нумерация Fail_N продолжается с наибольшего номера,
+        # даже если часть старых сканов удалена, и они не затираются
+        self.fail_count = max(
+            [int(match.group(1)) for match in map(FAIL_NAME.match, os.listdir(self.scans_path)) if match],
+            default=0
+        )
         self.warning_list = []
         self.error_list = []
-
-    def _get_image(self, src_image):
-        tmp_file = os.path.join(self.scans_path, 'tmp.png')
-        src_image.save(tmp_file, 'PNG')
-        image = cv2.resize(cv2.imread(tmp_file), (config.page.width, config.page.height))
-        os.remove(tmp_file)
-        return image
+        self.qr_search_stats = {'corners': 0, 'full': 0}
+        self.recovery_stats = {'pages': 0, 'recovered': 0, 'seconds': 0.0}
 
     def restore(self, src_image):
-        image = self._get_image(src_image)
-        retval, data, points, _ = cv2.QRCodeDetector().detectAndDecodeMulti(image)
-        coords = {pos: None for pos in self.ref_coords.keys()}
-        image_key = "UNKNOWN"
-
-        if retval:
-            for i, (d, p) in enumerate(zip(data, points)):
-                if '|' in d:
-                    pos, image_key = d.split('|')
-                    coords[pos] = [p[0], p[2]]
-                    
-            found_codes = [key for key, value in coords.items() if value is not None]
-            num_found = len(found_codes)
-
-            if num_found == 3:
-                src_pts = np.float32([coords[pos][1] for pos in found_codes])
-                dst_pts = np.float32([self.ref_coords[pos][1] for pos in found_codes])
-                M = cv2.getAffineTransform(src_pts, dst_pts)
-                image = cv2.warpAffine(image, M, (config.page.width, config.page.height), flags=cv2.INTER_LINEAR)
-                
-            elif num_found == 2:
-                self.warning_list.append(f"{image_key}: Only two QR codes found.")
-                
-
-            elif num_found == 1:
-                self.warning_list.append(f"{image_key}: Only one QR code found.")
-                # Handle the case with only one point here, if needed
-
-        else:
+        return self._save(align_page(src_image, self.ref_coords, self.grayscale, self.store_matrix, self.plan))[1]
+
+    def restore_all(self, src_images, jobs=1):
+        '''
+        Restore pages on a process pool, logs and Fail_N numbering
+        follow the page order as in sequential run. Returns paths of saved scans
+        '''
+        results = ordered_map(
+            partial(align_page, ref_coords=self.ref_coords, grayscale=self.grayscale,
+                    store_matrix=self.store_matrix, plan=self.plan),
+            src_images,
+            jobs=jobs
+        )
+        return [self._save(result)[1] for result in results]
+
+    def _save(self, result):
+        '''
+        Log the page and write its png if there is one, returns the page key and the png path
+        '''
+        image_key, warning = result['key'], result['warning']
+        self.qr_search_stats[result['qr_search']] += 1
+        if result['recovery'] is not None:
+            self.recovery_stats['pages'] += 1
+            self.recovery_stats['recovered'] += result['recovery']['ok']
+            self.recovery_stats['seconds'] += result['recovery']['seconds']
+        if image_key is None:
             self.fail_count += 1
             self.error_list.append(f"Fail_{self.fail_count}: No QR codes found.")
             image_key = f"Fail_{self.fail_count}"
+        elif warning is not None:
+            self.warning_list.append(f"{image_key}: {warning}")
 
+        if result['png'] is None:
+            return image_key, None
         output_path = os.path.join(self.scans_path, f"{image_key}.png")
-        cv2.imwrite(output_path, image)
+        with metrics.stage('png_write'), open(output_path, 'wb') as f:
+            f.write(result['png'])
+        if result.get('matrix') is not None:
+            np.save(matrix_path(output_path), result['matrix'])
+        elif os.path.isfile(matrix_path(output_path)):
+            # страница перезаписана уже выровненной, старая матрица не нужна
+            os.remove(matrix_path(output_path))
+        return image_key, output_path
+
+    def restore_and_read(self, src_images, reader, jobs=1, audit_every=0):
+        '''
+        Align pages and hand their cells to the reader in memory without
+        writing scans, only pages without codes and audit samples are saved
+        '''
+        results = ordered_map(
+            partial(
+                align_and_extract,
+                ref_coords=self.ref_coords,
+                plan=reader.plan,
+                grayscale=self.grayscale,
+                audit_every=audit_every
+            ),
+            enumerate(src_images),
+            jobs=jobs
+        )
+        for result in results:
+            image_key, _ = self._save(result)
+            if result['key'] is not None:
+                reader.add_page(image_key, result['rois'], result['found'])
+        reader.flush()
 
     def get_logs(self):
         return self.warning_list, self.error_list
 
+    def get_stats(self):
+        '''
+        Share of pages aligned by each qr search path and how many pages
+        with one or two codes were recovered by the answer boxes, with the mean added time
+        '''
+        total = sum(self.qr_search_stats.values())
+        stats = {
+            path: {'pages': count, 'rate': round(count / total, 3) if total else 0}
+            for path, count in self.qr_search_stats.items()
+        }
+        pages = self.recovery_stats['pages']
+        stats['recovery'] = {
+            'pages': pages,
+            'recovered': self.recovery_stats['recovered'],
+            'rate': round(self.recovery_stats['recovered'] / pages, 3) if pages else 0,
+            'mean_ms': round(1000 * self.recovery_stats['seconds'] / pages, 1) if pages else 0
+        }
+        return stats
@@ -0,0 +1,43 @@
+import os
+import shutil
+
+
+class InboxWatcher:
+    '''
+    Polls the inbox folder for scanned pdfs. A file is ready once its size
+    stops changing between two polls, so pdfs still being written are skipped.
+    Processed files are moved to inbox/done, broken ones to inbox/failed
+    '''
+
+    def __init__(self, inbox_path, extensions=('.pdf',)):
+        self.inbox_path = inbox_path
+        self.extensions = extensions
+        self.done_path = os.path.join(inbox_path, 'done')
+        self.failed_path = os.path.join(inbox_path, 'failed')
+        for path in (self.inbox_path, self.done_path, self.failed_path):
+            os.makedirs(path, exist_ok=True)
+        self._sizes = {}
+
+    def ready_files(self):
+        sizes = {}
+        for entry in os.scandir(self.inbox_path):
+            if entry.is_file() and entry.name.lower().endswith(self.extensions):
+                sizes[entry.path] = entry.stat().st_size
+        ready = [
+            path for path, size in sizes.items()
+            if size > 0 and self._sizes.get(path) == size
+        ]
+        self._sizes = sizes
+        return sorted(ready, key=os.path.getmtime)
+
+    def archive(self, path, failed=False):
+        target = self.failed_path if failed else self.done_path
+        name = os.path.basename(path)
+        # одинаковые имена от сканера не затирают уже обработанные файлы
+        stem, ext = os.path.splitext(name)
+        idx = 1
+        while os.path.exists(os.path.join(target, name)):
+            name = f'{stem}_{idx}{ext}'
+            idx += 1
+        shutil.move(path, os.path.join(target, name))
+        self._sizes.pop(path, None)
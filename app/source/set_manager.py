@@ -1,14 +1,10 @@
 import json
-from app.source.modules.generator import BlankGenerator
-from app.source.modules.restorer import BlankRestorer
-from app.source.modules.reader import BlankReader
-import app.source.modules.evaluator as eval
-from PIL import Image
 import os
-import shutil
-from pdf2image import convert_from_path
-import pandas as pd
-import json
+
+from app.source.utils.metrics import metrics
+
+# Модули этапов импортируются внутри методов, чтобы каждый режим
+# загружал только нужные ему зависимости (tensorflow, pandas, pdf2image)
 
 
 class SetManager:
@@ -43,48 +39,152 @@ class SetManager:
         with open(f"{path}description.json", "w") as f:
             json.dump(data, f, indent=4)
 
-    def generate_set(self, set_name):
+    def generate_set(self, set_name, jobs=1, split_by_prefix=False, pages_per_file=None, bilevel=False):
+        from app.source.modules.generator import BlankGenerator
+        from app.source.utils.pdf import PdfWriter
+
         set_path = os.path.join(self.path, set_name)
-        blanks_path = os.path.join(set_path, 'blanks')
-        os.mkdir(blanks_path)
         bg = BlankGenerator(set_path)
-        bg.generate()
-
-        images = [
-            Image.open(os.path.join(blanks_path,f'{blank}.png')) for blank in bg.keys
-        ]
 
-        images[0].save(
-            os.path.join(set_path, 'blanks.pdf'),
-            save_all=True,
-            append_images=images[1:])
+        writer, prefix, part = None, None, 0
+        for key, blank in bg.iter_blanks(jobs=jobs):
+            key_prefix = bg.key_prefixes[key] if split_by_prefix else None
+            if writer is not None and key_prefix == prefix and not (
+                    pages_per_file and writer.page_count >= pages_per_file):
+                writer.add_page(blank.canvas)
+                continue
+            if writer is not None:
+                writer.close()
+            part = part + 1 if writer is not None and key_prefix == prefix else 1
+            prefix = key_prefix
+            writer = PdfWriter(
+                os.path.join(set_path, self._blanks_file_name(prefix, part if pages_per_file else None)),
+                bilevel=bilevel
+            )
+            writer.add_page(blank.canvas)
+        if writer is not None:
+            writer.close()
+
+        bg.dump()
+
+    @staticmethod
+    def _blanks_file_name(prefix=None, part=None):
+        parts = ['blanks']
+        if prefix is not None:
+            parts.append(prefix.strip('-_ ') or 'codes')
+        if part is not None:
+            parts.append(f'{part:03}')
+        return '_'.join(parts) + '.pdf'
+
+    def restore_blanks(self, set_name, jobs=1, window=8, grayscale=True, store_matrix=False):
+        from app.source.modules.restorer import BlankRestorer
+        from app.source.utils.pdf import iter_pdf_pages
 
-        shutil.rmtree(blanks_path)
-
-    def restore_blanks(self, set_name):
         set_path = os.path.join(self.path, set_name)
-        images = convert_from_path(os.path.join(set_path, 'scans.pdf')) 
+        images = iter_pdf_pages(os.path.join(set_path, 'scans.pdf'), window=window)
 
-        restorer = BlankRestorer(set_path)
+        restorer = BlankRestorer(set_path, grayscale=grayscale, store_matrix=store_matrix)
 
-        for image in images:
-            restorer.restore(image)
+        restorer.restore_all(images, jobs=jobs)
 
         warnings, errors = restorer.get_logs()
 
         print(warnings, errors)
+        stats = restorer.get_stats()
+        print(stats)
+        return stats
+
 
+    def get_answers(self, set_name, jobs=1, pages_per_batch=16, backend='keras', review_threshold=None):
+        from app.source.modules.reader import BlankReader, RecognitionCache
 
-    def get_answers(self, set_name):
         set_path = os.path.join(self.path, set_name)
         scans_path = os.path.join(set_path, 'scans')  
         
-        reader = BlankReader(set_path) 
-        reader.recognize_answers_in_folder(scans_path)  
+        reader = BlankReader(set_path, pages_per_batch=pages_per_batch, backend=backend,
+                             review_threshold=review_threshold) 
+        cache_path = os.path.join(set_path, 'recognition_cache.npz')
+        cache = RecognitionCache.load(cache_path, reader.fingerprint())
+        reader.recognize_answers_in_folder(scans_path, jobs=jobs, cache=cache)  
         reader.save_data(set_path) 
+        cache.save(cache_path, len(reader.plan))
+        print(f'recognized {cache.recognized} scans, reused {cache.reused}')
+        if reader.review is not None:
+            print(reader.review.get_stats())
+
+
+    def process_set(self, set_name, jobs=1, backend='keras', audit_every=0, window=8, grayscale=True):
+        '''
+        restore and recognize in one pass, aligned pages go to recognition in memory.
+        Scans are written only for pages without codes and every audit_every-th page
+        '''
+        from app.source.modules.restorer import BlankRestorer
+        from app.source.modules.reader import BlankReader
+        from app.source.utils.pdf import iter_pdf_pages
+
+        set_path = os.path.join(self.path, set_name)
+        images = iter_pdf_pages(os.path.join(set_path, 'scans.pdf'), window=window)
+
+        restorer = BlankRestorer(set_path, grayscale=grayscale)
+        reader = BlankReader(set_path, pages_per_batch=16, backend=backend)
+        restorer.restore_and_read(images, reader, jobs=jobs, audit_every=audit_every)
+        reader.save_data(set_path)
+
+        warnings, errors = restorer.get_logs()
+        print(warnings, errors)
+        print(restorer.get_stats())
+
+
+    def watch_set(self, set_name, jobs=1, backend='keras', interval=2.0, window=8, grayscale=True):
+        '''
+        Restore, recognize and grade every pdf dropped into the inbox folder of the set
+        as it lands, the model stays loaded between pdfs. Stops on Ctrl+C
+        '''
+        import time
+        from app.source.modules.restorer import BlankRestorer
+        from app.source.modules.reader import BlankReader, RecognitionCache
+        from app.source.modules.watcher import InboxWatcher
+        from app.source.utils.pdf import iter_pdf_pages
+
+        set_path = os.path.join(self.path, set_name)
+        watcher = InboxWatcher(os.path.join(set_path, 'inbox'))
+        restorer = BlankRestorer(set_path, grayscale=grayscale)
+        reader = BlankReader(set_path, pages_per_batch=16, backend=backend)
+        cache_path = os.path.join(set_path, 'recognition_cache.npz')
+        cache = RecognitionCache.load(cache_path, reader.fingerprint())
+
+        # сканы прошлых запусков берутся из кэша
+        reader.recognize_answers_in_folder(restorer.scans_path, jobs=jobs, cache=cache)
+        print(f'watching {watcher.inbox_path}')
+        try:
+            while True:
+                for pdf_path in watcher.ready_files():
+                    print(pdf_path)
+                    logged = [len(log) for log in restorer.get_logs()]
+                    # ошибка в одном pdf не должна останавливать наблюдение
+                    try:
+                        scans = restorer.restore_all(iter_pdf_pages(pdf_path, window=window), jobs=jobs)
+                        print(*[log[start:] for log, start in zip(restorer.get_logs(), logged)])
+                        scans = [path for path in scans if not os.path.basename(path).startswith('Fail_')]
+                        reader.recognize_answers_in_files(scans, jobs=jobs, cache=cache)
+                        reader.save_data(set_path)
+                        cache.save(cache_path, len(reader.plan))
+                        self.get_results(set_name)
+                    except Exception as e:
+                        print(f'{pdf_path}: {e!r}')
+                        watcher.archive(pdf_path, failed=True)
+                        continue
+                    watcher.archive(pdf_path)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print(restorer.get_stats())
 
 
     def get_results(self, set_name):
+        import pandas as pd
+        import app.source.modules.evaluator as eval
+        from app.source.utils.files import atomic_open
+
         set_path = os.path.join(self.path, set_name)
         with open(os.path.join(set_path, 'description.json'), 'r') as f:
             description = json.load(f)
@@ -101,8 +201,16 @@ class SetManager:
                 else:
                     raise ValueError(f'Unknown type {problem_type}')
         ans_table = pd.read_csv(os.path.join(set_path, 'recognized.csv'))
-        evaluated_table = eval.Evaluator(*problems).eval_table(ans_table)
-        evaluated_table.to_csv(os.path.join(set_path, 'results.csv'), index=False)
+        ans_table = ans_table.set_index(ans_table.columns[0], drop=False)
+        cache_path = os.path.join(set_path, 'grading_cache.json')
+        cache = eval.GradingCache.load(cache_path)
+        with metrics.stage('grading', items=ans_table.shape[0] * len(problems)):
+            evaluated_table = eval.Evaluator(*problems).eval_table(ans_table, cache=cache)
+        with metrics.stage('csv_write', items=evaluated_table.shape[0]):
+            with atomic_open(os.path.join(set_path, 'results.csv')) as f:
+                evaluated_table.to_csv(f, index=False)
+        cache.save(cache_path)
+        print(f'graded {cache.graded} cells, reused {cache.reused}')
 
 
 if __name__ == '__main__':
@@ -22,6 +22,11 @@ class Configuration:
         def __init__(self, page):
             self.box_size = 9
             self.size = 21 * self.box_size
+            self.search_padding = 100
+            self.search_scale = 1.0
+            # восстановление по сетке ячеек, если найдено один-два кода
+            self.recovery_widen = 3
+            self.recovery_min_share = 0.5
             self.coords = {
                 'tl': [[page.margin, page.margin],
                        [page.margin + self.size, page.margin + self.size]],
@@ -0,0 +1,33 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+def _file_mode(path):
+    '''
+    Mode of the existing file, otherwise the one plain open would give
+    '''
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    '''
+    Write into a temporary file next to path and move it over path on success,
+    readers never see a half written file
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp_')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        # mkstemp создаёт файл с правами 0600
+        os.chmod(tmp_path, _file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -10,7 +10,9 @@ def get_canvas(height, width) -> np.ndarray:
 
 
 def save_canvas(path: str, canvas: np.ndarray) -> None:
-    cv2.imwrite(path, canvas)
+    # cv2.imwrite не бросает исключений, а только возвращает False
+    if not cv2.imwrite(path, canvas):
+        raise OSError(f'Could not write {path}')
 
 
 class Cursor:
@@ -152,21 +154,25 @@ class Drawer:
         def __init__(self, canvas) -> None:
             self.canvas = canvas
 
-        def _create(self, data: str):
+        @staticmethod
+        def create(data: str) -> np.ndarray:
+            '''
+            Render qr modules straight into a gray patch, without PIL
+            '''
             qr = qrcode.QRCode(
                 version=1, box_size=config.qr.box_size, border=0)
             qr.add_data(data)
-            img_qr = qr.make_image(
-                fill_color="black", back_color="white").convert('RGB')
-            img_qr = cv2.cvtColor(
-                np.array(img_qr, dtype=np.uint8), cv2.COLOR_RGB2GRAY)
-            img_qr = cv2.resize(
-                img_qr, (config.qr.size, config.qr.size), interpolation=cv2.INTER_NEAREST)
+            modules = np.array(qr.get_matrix(), dtype=bool)
+            img_qr = np.where(modules, 0, 255).astype(np.uint8)
+            img_qr = img_qr.repeat(config.qr.box_size, axis=0).repeat(config.qr.box_size, axis=1)
+            if img_qr.shape != (config.qr.size, config.qr.size):
+                img_qr = cv2.resize(
+                    img_qr, (config.qr.size, config.qr.size), interpolation=cv2.INTER_NEAREST)
             return img_qr
 
-        def __call__(self, coords, data: str):
+        def __call__(self, coords, data: str = None, patch: np.ndarray = None):
             x1, y1, x2, y2 = coords[0][0], coords[0][1], coords[1][0], coords[1][1]
-            self.canvas[y1:y2, x1:x2] = self._create(data)
+            self.canvas[y1:y2, x1:x2] = self.create(data) if patch is None else patch
 
     def __init__(self, canvas):
         self.text = self.Text(
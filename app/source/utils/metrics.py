@@ -0,0 +1,74 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    '''
+    Wall time, call count and item count of every pipeline stage.
+    Disabled by default, then stage() costs a single flag check
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, items=1):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, items)
+
+    def add(self, name, seconds, items=1, calls=1):
+        entry = self.stages.setdefault(name, [0, 0.0, 0])
+        entry[0] += calls
+        entry[1] += seconds
+        entry[2] += items
+
+    def merge(self, stages):
+        for name, (calls, seconds, items) in stages.items():
+            self.add(name, seconds, items, calls)
+
+    def drain(self):
+        '''
+        Take the collected stages and start over, used to ship worker metrics to the parent
+        '''
+        stages, self.stages = self.stages, {}
+        return stages
+
+    def to_dict(self):
+        return {
+            name: {'calls': calls, 'seconds': round(seconds, 6), 'items': items}
+            for name, (calls, seconds, items) in self.stages.items()
+        }
+
+    def to_prometheus(self, prefix='form_reader_stage'):
+        lines = []
+        for field, idx, help_text in (
+            ('seconds_total', 1, 'Wall time spent in the stage'),
+            ('calls_total', 0, 'Number of stage calls'),
+            ('items_total', 2, 'Number of items processed by the stage'),
+        ):
+            lines.append(f'# HELP {prefix}_{field} {help_text}')
+            lines.append(f'# TYPE {prefix}_{field} counter')
+            for name, entry in self.stages.items():
+                lines.append(f'{prefix}_{field}{{stage="{name}"}} {entry[idx]}')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        '''
+        Prometheus text for .prom files, json otherwise
+        '''
+        with open(path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=4)
+
+
+metrics = Metrics()
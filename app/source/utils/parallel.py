@@ -0,0 +1,42 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from app.source.utils.metrics import metrics
+
+
+def _call_with_metrics(func, enabled, item):
+    '''
+    Runs in the worker, stage metrics of the call go back with the result
+    '''
+    metrics.enabled = enabled
+    metrics.drain()
+    return func(item), metrics.drain()
+
+
+def ordered_map(func, iterable, jobs=1, prefetch=None):
+    '''
+    Lazy map over a process pool, results are yielded in input order.
+    At most prefetch items are in flight, so long inputs are never
+    materialized. With jobs <= 1 everything runs in the current process.
+    Stage metrics collected by workers are merged into the parent ones
+    '''
+    if jobs <= 1:
+        yield from map(func, iterable)
+        return
+    if prefetch is None:
+        prefetch = 2 * jobs
+    call = partial(_call_with_metrics, func, metrics.enabled)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = deque()
+        for item in iterable:
+            futures.append(executor.submit(call, item))
+            if len(futures) >= prefetch:
+                yield _collect(futures.popleft())
+        while futures:
+            yield _collect(futures.popleft())
+
+
+def _collect(future):
+    result, stages = future.result()
+    metrics.merge(stages)
+    return result
@@ -0,0 +1,114 @@
+import zlib
+import cv2
+import numpy as np
+from app.source.utils.metrics import metrics
+
+
+def iter_pdf_pages(pdf_path, window=8, **kwargs):
+    '''
+    Rasterize pdf lazily, at most window pages are decoded at once
+    '''
+    from pdf2image import convert_from_path, pdfinfo_from_path
+
+    page_count = pdfinfo_from_path(pdf_path)['Pages']
+    for first_page in range(1, page_count + 1, window):
+        last_page = min(first_page + window - 1, page_count)
+        with metrics.stage('pdf_rasterize', items=last_page - first_page + 1):
+            pages = convert_from_path(
+                pdf_path,
+                first_page=first_page,
+                last_page=last_page,
+                **kwargs
+            )
+        yield from pages
+
+
+class PdfWriter:
+    '''
+    Minimal pdf writer which appends pages as soon as they are drawn.
+    Every page is one lossless image, only object offsets stay in memory.
+    With bilevel gray pages are stored with 1 bit per pixel
+    '''
+
+    def __init__(self, path, resolution=72.0, bilevel=False):
+        self.path = path
+        self.resolution = resolution
+        self.bilevel = bilevel
+        self._file = open(path, 'wb')
+        self._offsets = [None, None]
+        self._page_ids = []
+        self._file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    def _new_id(self):
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def _write_object(self, obj_id, body, stream=None):
+        self._offsets[obj_id - 1] = self._file.tell()
+        self._file.write(f'{obj_id} 0 obj\n'.encode())
+        self._file.write(body.encode())
+        if stream is not None:
+            self._file.write(b'\nstream\n')
+            self._file.write(stream)
+            self._file.write(b'\nendstream')
+        self._file.write(b'\nendobj\n')
+
+    def add_page(self, canvas: np.ndarray):
+        height, width = canvas.shape[:2]
+        bits = 8
+        if canvas.ndim == 2 and self.bilevel:
+            color_space = '/DeviceGray'
+            bits = 1
+            data = np.packbits(canvas >= 128, axis=1)
+        elif canvas.ndim == 2:
+            color_space = '/DeviceGray'
+            data = canvas
+        else:
+            color_space = '/DeviceRGB'
+            data = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
+        data = zlib.compress(np.ascontiguousarray(data).tobytes())
+
+        image_id, content_id, page_id = self._new_id(), self._new_id(), self._new_id()
+        self._write_object(
+            image_id,
+            f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+            f'/ColorSpace {color_space} /BitsPerComponent {bits} '
+            f'/Filter /FlateDecode /Length {len(data)} >>',
+            data
+        )
+        page_width = width * 72.0 / self.resolution
+        page_height = height * 72.0 / self.resolution
+        content = f'q {page_width:g} 0 0 {page_height:g} 0 0 cm /Im0 Do Q'.encode()
+        self._write_object(content_id, f'<< /Length {len(content)} >>', content)
+        self._write_object(
+            page_id,
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:g} {page_height:g}] '
+            f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>'
+        )
+        self._page_ids.append(page_id)
+
+    def close(self):
+        if self._file.closed:
+            return
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self._page_ids)
+        self._write_object(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>')
+        self._write_object(1, '<< /Type /Catalog /Pages 2 0 R >>')
+        xref_offset = self._file.tell()
+        self._file.write(f'xref\n0 {len(self._offsets) + 1}\n0000000000 65535 f \n'.encode())
+        for offset in self._offsets:
+            self._file.write(f'{offset:010} 00000 n \n'.encode())
+        self._file.write(
+            f'trailer\n<< /Size {len(self._offsets) + 1} /Root 1 0 R >>\n'
+            f'startxref\n{xref_offset}\n%%EOF\n'.encode()
+        )
+        self._file.close()
@@ -0,0 +1,50 @@
+import unittest
+import importlib.util
+import os
+import numpy as np
+import sys
+sys.path.append('../')
+from app.source.modules.backends import KerasBackend, OnnxBackend, create_backend
+
+# 32x32 вырезки ячеек синтетических сканов и метки, которые дала им модель Keras
+FIXTURE = os.path.join(os.path.dirname(__file__), 'data', 'backend_rois.npz')
+
+
+def load_fixture():
+    with np.load(FIXTURE) as data:
+        return data['rois'].astype(np.float32) / 255, data['labels']
+
+
+class TestOnnxBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = create_backend('onnx', 'app/model/AM_50.model')
+
+    def test_model_path(self):
+        self.assertEqual(self.backend.model_path, 'app/model/AM_50.onnx')
+        self.assertRaises(ValueError, create_backend, 'tflite', 'app/model/AM_50.model')
+
+    def test_matches_keras_labels(self):
+        rois, labels = load_fixture()
+        preds = self.backend.predict(rois, batch_size=32)
+        self.assertEqual(preds.shape, (len(rois), 13))
+        np.testing.assert_allclose(preds.sum(axis=1), 1, rtol=1e-4)
+        np.testing.assert_array_equal(preds.argmax(axis=1), labels)
+
+    def test_dnn_runner_matches_keras_labels(self):
+        rois, labels = load_fixture()
+        dnn = OnnxBackend(self.backend.model_path)
+        dnn._run = dnn._dnn_runner()
+        np.testing.assert_array_equal(dnn.predict(rois, batch_size=32).argmax(axis=1), labels)
+
+    @unittest.skipUnless(importlib.util.find_spec('tensorflow'), 'tensorflow is not installed')
+    def test_matches_live_keras(self):
+        rois, _ = load_fixture()
+        keras_preds = KerasBackend('app/model/AM_50.model').predict(rois, batch_size=32)
+        preds = self.backend.predict(rois, batch_size=32)
+        np.testing.assert_array_equal(preds.argmax(axis=1), keras_preds.argmax(axis=1))
+        np.testing.assert_allclose(preds, keras_preds, atol=1e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
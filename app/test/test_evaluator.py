@@ -3,7 +3,7 @@ import numpy as np
 import pandas as pd
 import sys
 sys.path.append('../')
-from source.evaluator import Problem, SortProblem, MatchProblem, Evaluator
+from app.source.modules.evaluator import Problem, SortProblem, MatchProblem, Evaluator, GradingCache
 
 class TestProblem(unittest.TestCase):
     
@@ -49,6 +49,29 @@ class TestSortProblem(unittest.TestCase):
         self.assertEqual(problem.evaluate('BCDEA'), 1)
         self.assertEqual(problem.evaluate('ADCBE'), 2)
         self.assertEqual(problem.evaluate('EDCBA'), 0)
+
+    def test_evaluate_many(self):
+        problem = SortProblem(ref_ans='ABCDE', max_pts=5, min_share=0.5)
+        answers = ['ABCDE', 'BACDE', 'BCDEA', 'ADCBE', 'EDCBA',
+                   'AAAAA', 'AABBB', 'AABAB', 'ABEDE', 'AB', '', 'XYZ__']
+        np.testing.assert_array_equal(
+            problem.evaluate_share_many(answers),
+            [problem.evaluate_share(ans) for ans in answers])
+        np.testing.assert_array_equal(
+            problem.evaluate_many(answers),
+            [problem.evaluate(ans) for ans in answers])
+
+        for ref_ans in ('AA', 'A'):
+            problem = SortProblem(ref_ans=ref_ans, max_pts=5, min_share=0.5)
+            with self.assertRaises(ZeroDivisionError):
+                problem.evaluate('A')
+            with self.assertRaises(ZeroDivisionError):
+                problem.evaluate_many(['A', ''])
+
+    def test_evaluate_many_longer_evaluated_answer(self):
+        problem = SortProblem(ref_ans='ABCDE', max_pts=10, min_share=0.5)
+        with self.assertRaises(ValueError):
+            problem.evaluate_many(['ABCDE', 'ABCDEFGH'])
         
         
 class TestMatchProblem(unittest.TestCase):
@@ -58,6 +81,20 @@ class TestMatchProblem(unittest.TestCase):
         self.assertEqual(problem.evaluate('ABCDE'), 5)
         self.assertEqual(problem.evaluate('AACDE'), 3)
         self.assertEqual(problem.evaluate('AXCDE'), 4)
+
+    def test_evaluate_many(self):
+        problem = MatchProblem(ref_ans='BACED', max_pts=10)
+        answers = ['BACED', 'ABCDE', 'BADCE', 'AABCD', 'BA', '', 'XXXXX']
+        np.testing.assert_array_equal(
+            problem.evaluate_many(answers),
+            [problem.evaluate(ans) for ans in answers])
+
+    def test_evaluate_longer_evaluated_answer(self):
+        problem = MatchProblem(ref_ans='ABCDE', max_pts=5)
+        with self.assertRaises(ValueError):
+            problem.evaluate('ABCDEF')
+        with self.assertRaises(ValueError):
+            problem.evaluate_many(['ABCDE', 'ABCDEF'])
         
     def test_init(self):
         problem = MatchProblem(ref_ans='BAC', max_pts=10)
@@ -96,3 +133,28 @@ class TestEvaluator(unittest.TestCase):
             3: [2, 4, 2]
         })
         pd.testing.assert_frame_equal(pts_table, expected_table)
+
+    def test_eval_table_cache(self):
+        ans_table = pd.DataFrame({
+            'Code': ['09-0', '09-1', '09-2'],
+            'S1Q1': ['ABCDE', 'BADCE', 'AABCD'],
+            'S1Q2': ['ABCDE', 'BADCE', 'AABCD']
+        }).set_index('Code', drop=False)
+        cache = GradingCache()
+        evl = Evaluator(SortProblem(ref_ans='ABDCE', max_pts=10, min_share=0.5),
+                        MatchProblem(ref_ans='BACED', max_pts=10))
+        pd.testing.assert_frame_equal(evl.eval_table(ans_table, cache=cache),
+                                      evl.eval_table(ans_table))
+        self.assertEqual((cache.graded, cache.reused), (6, 0))
+
+        ans_table.loc['09-1', 'S1Q2'] = 'BACED'
+        pts_table = evl.eval_table(ans_table, cache=cache)
+        self.assertEqual((cache.graded, cache.reused), (7, 5))
+        self.assertEqual(pts_table.loc['09-1', 'S1Q2'], 10)
+
+        evl = Evaluator(SortProblem(ref_ans='ABCDE', max_pts=10, min_share=0.5),
+                        MatchProblem(ref_ans='BACED', max_pts=10))
+        cache = GradingCache(cache.columns)
+        pts_table = evl.eval_table(ans_table, cache=cache)
+        pd.testing.assert_frame_equal(pts_table, evl.eval_table(ans_table))
+        self.assertEqual((cache.graded, cache.reused), (3, 3))
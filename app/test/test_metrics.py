@@ -0,0 +1,45 @@
+import unittest
+import sys
+sys.path.append('../')
+from app.source.utils.metrics import Metrics, metrics
+from app.source.utils.parallel import ordered_map
+
+
+def square(x):
+    with metrics.stage('square', items=2):
+        return x * x
+
+
+class TestMetrics(unittest.TestCase):
+
+    def tearDown(self):
+        metrics.enabled = False
+        metrics.drain()
+
+    def test_disabled_records_nothing(self):
+        m = Metrics()
+        with m.stage('imread'):
+            pass
+        self.assertEqual(m.to_dict(), {})
+
+    def test_stage_and_prometheus(self):
+        m = Metrics()
+        m.enabled = True
+        for _ in range(3):
+            with m.stage('predict', items=10):
+                pass
+        m.merge({'predict': [1, 0.5, 5]})
+        stats = m.to_dict()['predict']
+        self.assertEqual((stats['calls'], stats['items']), (4, 35))
+        self.assertGreaterEqual(stats['seconds'], 0.5)
+        self.assertIn('form_reader_stage_items_total{stage="predict"} 35', m.to_prometheus())
+
+    def test_worker_metrics_are_merged(self):
+        metrics.enabled = True
+        self.assertEqual(list(ordered_map(square, range(5), jobs=2)), [0, 1, 4, 9, 16])
+        stats = metrics.to_dict()['square']
+        self.assertEqual((stats['calls'], stats['items']), (5, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
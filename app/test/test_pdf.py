@@ -0,0 +1,64 @@
+import unittest
+import os
+import re
+import tempfile
+import zlib
+import numpy as np
+import sys
+sys.path.append('../')
+from app.source.utils.pdf import PdfWriter
+
+
+class TestPdfWriter(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_pages(self):
+        canvases = [np.full((40, 30), 255, dtype=np.uint8) for _ in range(3)]
+        canvases[1][10:20, 5:15] = 0
+        with PdfWriter(self.path) as writer:
+            for canvas in canvases:
+                writer.add_page(canvas)
+            self.assertEqual(writer.page_count, 3)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertTrue(data.startswith(b'%PDF-'))
+        self.assertTrue(data.rstrip().endswith(b'%%EOF'))
+        self.assertIn(b'/Count 3', data)
+
+        streams = re.findall(rb'/Subtype /Image .*?/Length (\d+) >>\nstream\n', data)
+        self.assertEqual(len(streams), 3)
+        second = data.index(b'/Subtype /Image', data.index(b'/Subtype /Image') + 1)
+        start = data.index(b'stream\n', second) + len(b'stream\n')
+        length = int(re.search(rb'/Length (\d+)', data[second:]).group(1))
+        image = np.frombuffer(zlib.decompress(data[start:start + length]), dtype=np.uint8)
+        np.testing.assert_array_equal(image.reshape(40, 30), canvases[1])
+
+    def test_bilevel(self):
+        canvas = np.full((4, 10), 255, dtype=np.uint8)
+        canvas[1, :9] = 0
+        with PdfWriter(self.path, bilevel=True) as writer:
+            writer.add_page(canvas)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertIn(b'/BitsPerComponent 1', data)
+        length = int(re.search(rb'/Subtype /Image .*?/Length (\d+)', data).group(1))
+        start = data.index(b'stream\n') + len(b'stream\n')
+        rows = np.frombuffer(zlib.decompress(data[start:start + length]), dtype=np.uint8)
+        np.testing.assert_array_equal(rows.reshape(4, 2), [[255, 192], [0, 64], [255, 192], [255, 192]])
+
+    def test_xref_offsets(self):
+        with PdfWriter(self.path) as writer:
+            writer.add_page(np.zeros((10, 10), dtype=np.uint8))
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        xref_offset = int(data.rsplit(b'startxref\n', 1)[1].split()[0])
+        self.assertTrue(data[xref_offset:].startswith(b'xref'))
+        entries = re.findall(rb'(\d{10}) 00000 n', data[xref_offset:])
+        for obj_id, offset in enumerate(entries, start=1):
+            self.assertTrue(data[int(offset):].startswith(f'{obj_id} 0 obj'.encode()))
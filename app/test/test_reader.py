@@ -0,0 +1,162 @@
+import unittest
+import json
+import os
+import tempfile
+import numpy as np
+import sys
+sys.path.append('../')
+import cv2
+from app.source.modules.generator import BlankGenerator
+from app.source.modules.reader import RecognitionPlan, ReviewQueue, RecognitionCache, ImageProcessor, extract_cells
+
+
+def make_plan(cells_per_question=(3, 2)):
+    questions = [
+        {'Metadata': {'thickness': 4}, 'Cells': [[[10 * i, 0], [10 * i + 8, 8]] for i in range(count)]}
+        for count in cells_per_question
+    ]
+    return RecognitionPlan({'Sections': [{'Questions': questions}]})
+
+
+class TestExtractCells(unittest.TestCase):
+
+    def setUp(self):
+        boxes = [[[100 + 90 * i, 200], [170 + 90 * i, 270]] for i in range(4)]
+        self.plan = RecognitionPlan({'Sections': [{'Questions': [
+            {'Metadata': {'thickness': 4}, 'Cells': boxes}
+        ]}]})
+        self.page = np.full((500, 600), 255, dtype=np.uint8)
+        for (x1, y1), (x2, y2) in boxes:
+            cv2.rectangle(self.page, (x1, y1), (x2, y2), 0, 4, cv2.LINE_4)
+            cv2.putText(self.page, 'A', (x1 + 20, y2 - 20), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 3)
+
+    def test_region_canvas(self):
+        rois, found = extract_cells(self.page, self.plan)
+        self.assertTrue(found.all())
+        crop, origin = ImageProcessor.warp_region(self.page, None, self.plan.region)
+        region_rois, region_found = extract_cells(crop, self.plan, origin)
+        np.testing.assert_array_equal(region_found, found)
+        np.testing.assert_array_equal(region_rois, rois)
+
+    def test_warp_region_matches_full_warp(self):
+        M = cv2.getRotationMatrix2D((300, 250), 1.0, 1.01)
+        full = cv2.warpAffine(self.page, M, (600, 500), flags=cv2.INTER_LINEAR)
+        crop, (x0, y0) = ImageProcessor.warp_region(self.page, M, self.plan.region)
+        expected = full[y0:y0 + crop.shape[0], x0:x0 + crop.shape[1]]
+        self.assertEqual(crop.shape, expected.shape)
+        # отличия только от округления интерполяции
+        self.assertLessEqual(np.abs(crop.astype(int) - expected).max(), 16)
+        self.assertLess(np.mean(crop != expected), 0.01)
+
+
+def extract_cells_per_cell(canvas, plan):
+    '''
+    The pipeline before page_contours: Otsu and contour search in the window of every cell
+    '''
+    rois = np.zeros((len(plan), 32, 32), dtype=np.float32)
+    found = np.zeros(len(plan), dtype=bool)
+    for idx, (box, delta, crop_delta) in enumerate(zip(plan.boxes.tolist(), plan.deltas.tolist(),
+                                                       plan.crop_deltas.tolist())):
+        wide_roi = ImageProcessor.roi_by_corners(canvas, box, delta)
+        _, binary_img = cv2.threshold(wide_roi, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        contours, _ = cv2.findContours(binary_img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        box_area = (box[2] - box[0]) * (box[3] - box[1])
+        areas = [cv2.contourArea(c) for c in contours]
+        larger = [(area - box_area, i) for i, area in enumerate(areas) if area > box_area]
+        if larger:
+            nearest = contours[min(larger)[1]]
+            roi = ImageProcessor.roi_by_wh(wide_roi, cv2.boundingRect(nearest), crop_delta)
+            rois[idx] = cv2.resize(ImageProcessor.prepare_roi_for_recognition(roi), (32, 32))
+            found[idx] = True
+    return rois, found
+
+
+class TestExtractCellsOnBlank(unittest.TestCase):
+
+    def test_matches_per_cell_pipeline(self):
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, 'description.json'), 'w') as f:
+                json.dump({
+                    'Codes': {'T-': 1},
+                    'Sections': [{'Questions': [
+                        {'ans': 'ABCDE', 'type': 'SORT'},
+                        {'ans': 'ABCDEFG', 'type': 'MATCH'}
+                    ]}]
+                }, f)
+            bg = BlankGenerator(path)
+            bg.draw_template()
+            bg.dump()
+            with open(os.path.join(path, 'generator_data.json')) as f:
+                plan = RecognitionPlan(json.load(f))
+            _, blank = next(bg.iter_blanks())
+        page = blank.canvas
+        for x1, y1, x2, y2 in plan.boxes.tolist()[::2]:
+            cv2.putText(page, 'K', (x1 + 12, y2 - 12), cv2.FONT_HERSHEY_SIMPLEX, 1.3, 0, 3, cv2.LINE_AA)
+
+        rois, found = extract_cells(page, plan)
+        expected_rois, expected_found = extract_cells_per_cell(page, plan)
+        self.assertTrue(expected_found.all())
+        np.testing.assert_array_equal(found, expected_found)
+        # на чистом бланке пороги совпадают, вырезки одинаковы
+        np.testing.assert_array_equal(rois, expected_rois)
+
+
+class TestReviewQueue(unittest.TestCase):
+
+    def test_only_uncertain_cells(self):
+        queue = ReviewQueue(make_plan(), "ABC_", threshold=0.8)
+        rois = np.random.default_rng(0).random((5, 32, 32), dtype=np.float32)
+        queue.add('P1', np.int8([0, 1, 2, 3, 0]), np.float32([0.99, 0.95, 0.9, 0.85, 0.99]), rois)
+        queue.add('P2', np.int8([0, -1, 2, 1, 0]), np.float32([0.99, 0, 0.5, 0.99, 0.99]), rois)
+        self.assertEqual(queue.get_stats()['pages_to_review'], 1)
+
+        with tempfile.TemporaryDirectory() as path:
+            queue.save(path)
+            data = np.load(os.path.join(path, 'review.npz'))
+            self.assertEqual(data['codes'].tolist(), ['P2', 'P2'])
+            self.assertEqual(data['index'].tolist(), [[0, 0, 1], [0, 0, 2]])
+            self.assertEqual(data['crops'].dtype, np.uint8)
+            np.testing.assert_allclose(data['crops'][1] / 255, rois[2], atol=1 / 255)
+            with open(os.path.join(path, 'review.json')) as f:
+                cells = json.load(f)['cells']
+            self.assertEqual([cell['ans'] for cell in cells], ['N/A', 'C'])
+            self.assertEqual(cells[1]['question'], 'S1Q1')
+
+
+
+class TestRecognitionCache(unittest.TestCase):
+
+    def test_save_load(self):
+        plan = make_plan()
+        cache = RecognitionCache(plan.fingerprint())
+        cache.update('a', np.int8([0, 1, 2, -1, 0]), np.float32([0.9, 0.8, 0.7, 0, 1]))
+        cache.update('b', np.int8([1, 1, 1, 1, 1]), np.float32([1, 1, 1, 1, 1]))
+        with tempfile.TemporaryDirectory() as path:
+            cache_path = os.path.join(path, 'cache.npz')
+            cache.save(cache_path, len(plan))
+
+            loaded = RecognitionCache.load(cache_path, plan.fingerprint())
+            labels, preds = loaded.lookup('a')
+            self.assertEqual(labels.tolist(), [0, 1, 2, -1, 0])
+            np.testing.assert_allclose(preds, [0.9, 0.8, 0.7, 0, 1])
+            self.assertIsNone(loaded.lookup('c'))
+            loaded.save(cache_path, len(plan))
+            self.assertEqual(list(RecognitionCache.load(cache_path, plan.fingerprint()).entries), ['a'])
+
+            other = make_plan((2, 3)).fingerprint()
+            self.assertNotEqual(other, plan.fingerprint())
+            self.assertEqual(RecognitionCache.load(cache_path, other).entries, {})
+
+    def test_save_empty(self):
+        plan = make_plan()
+        with tempfile.TemporaryDirectory() as path:
+            cache_path = os.path.join(path, 'cache.npz')
+            RecognitionCache(plan.fingerprint()).save(cache_path, len(plan))
+            loaded = RecognitionCache.load(cache_path, plan.fingerprint())
+            self.assertEqual(loaded.entries, {})
+            with np.load(cache_path) as data:
+                self.assertEqual(data['labels'].shape, (0, len(plan)))
+
+
+if __name__ == '__main__':
+    unittest.main()
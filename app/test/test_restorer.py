@@ -0,0 +1,202 @@
+import unittest
+from unittest import mock
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import cv2
+import numpy as np
+import sys
+sys.path.append('../')
+from app.source.modules.generator import BlankGenerator
+from app.source.modules.reader import BlankReader, RecognitionPlan
+from app.source.modules.restorer import BlankRestorer, align_image, detect_qr_in_corners
+from app.source.utils.config import config
+
+
+def make_set(path, count=1):
+    '''
+    Write description and generator data of a small set into path, returns (key, page) of its blanks
+    '''
+    with open(os.path.join(path, 'description.json'), 'w') as f:
+        json.dump({
+            'Codes': {'T-': count},
+            'Sections': [{'Questions': [{'ans': 'ABCDE', 'type': 'SORT'}] * 3}]
+        }, f)
+    bg = BlankGenerator(path)
+    bg.draw_template()
+    bg.dump()
+    return [(key, blank.canvas) for key, blank in bg.iter_blanks()]
+
+
+def scan_page(page, hidden=()):
+    '''
+    Paint over the hidden qr codes and turn the page a little as a scanner would.
+    Returns the scan and the distortion matrix
+    '''
+    page = page.copy()
+    for pos in hidden:
+        (x1, y1), (x2, y2) = config.qr.coords[pos]
+        page[y1 - 10:y2 + 10, x1 - 10:x2 + 10] = 255
+    D = cv2.getRotationMatrix2D((620, 877), 1.2, 0.98)
+    D[:, 2] += (12, -9)
+    return cv2.warpAffine(page, D, page.shape[::-1], borderValue=255), D
+
+
+class TestQrRecovery(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as path:
+            (cls.key, cls.page), = make_set(path)
+            with open(os.path.join(path, 'generator_data.json')) as f:
+                generator_data = json.load(f)
+        cls.ref_coords = generator_data['Codes']
+        cls.plan = RecognitionPlan(generator_data)
+
+    def scan(self, hidden):
+        return scan_page(self.page, hidden)
+
+    def check_alignment(self, hidden):
+        scan, D = self.scan(hidden)
+        result = align_image(scan, self.ref_coords, plan=self.plan)
+        self.assertEqual(result['key'], self.key)
+        self.assertTrue(result['recovery']['ok'])
+        self.assertIn('aligned by answer boxes', result['warning'])
+        # ячейки после выравнивания возвращаются на свои места
+        corners = self.plan.boxes.reshape(-1, 2).astype(np.float32)
+        restored = cv2.transform(cv2.transform(corners[None], D), result['matrix'])[0]
+        self.assertLess(np.abs(restored - corners).max(), 2.0)
+
+    def test_two_codes(self):
+        self.check_alignment(['tr'])
+
+    def test_one_code(self):
+        self.check_alignment(['tr', 'bl'])
+
+    def test_full_page_search_misses_codes(self):
+        scan, _ = self.scan(['tr'])
+        data, points = detect_qr_in_corners(scan, self.ref_coords)
+        self.assertEqual(len(data), 2)
+        # поиск по всей странице находит меньше кодов, чем поиск в углах
+        for page_hits in ([], []), ([data[0]], [points[0]]):
+            with mock.patch('app.source.modules.restorer.detect_qr_in_page', return_value=page_hits):
+                result = align_image(scan, self.ref_coords, plan=self.plan)
+            self.assertEqual(result['key'], self.key)
+            self.assertEqual(result['qr_search'], 'full')
+            self.assertEqual(result['warning'], 'Only two QR codes found, aligned by answer boxes.')
+
+    def test_without_plan(self):
+        scan, _ = self.scan(['tr'])
+        result = align_image(scan, self.ref_coords)
+        self.assertIsNone(result['matrix'])
+        self.assertIsNone(result['recovery'])
+        self.assertEqual(result['warning'], 'Only two QR codes found.')
+
+
+class TestBlankRestorer(unittest.TestCase):
+
+    def test_fail_numbering_continues_after_gap(self):
+        with tempfile.TemporaryDirectory() as path:
+            make_set(path)
+            scans_path = os.path.join(path, 'scans')
+            os.makedirs(scans_path)
+            # Fail_1.png удалён оператором
+            for name in ('Fail_2.png', 'Fail_3.png'):
+                with open(os.path.join(scans_path, name), 'wb') as f:
+                    f.write(name.encode())
+
+            restorer = BlankRestorer(path)
+            saved = restorer.restore_all([np.full((config.page.height, config.page.width), 255, dtype=np.uint8)])
+            self.assertEqual(saved, [os.path.join(scans_path, 'Fail_4.png')])
+            self.assertEqual(restorer.get_logs()[1], ['Fail_4: No QR codes found.'])
+            with open(os.path.join(scans_path, 'Fail_3.png'), 'rb') as f:
+                self.assertEqual(f.read(), b'Fail_3.png')
+
+
+class TestRestoreAndRead(unittest.TestCase):
+    '''
+    Fused restore and recognize against restore_all with recognition of the saved scans
+    '''
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.blanks = make_set(self.dir.name, count=5)
+        with open(os.path.join(self.dir.name, 'generator_data.json')) as f:
+            self.plan = RecognitionPlan(json.load(f))
+        letters = 'ABCDEFGHIJKLM'
+        for page_idx, (_, page) in enumerate(self.blanks):
+            for idx, (x1, y1, x2, y2) in enumerate(self.plan.boxes.tolist()):
+                letter = letters[(page_idx + idx) % len(letters)]
+                cv2.putText(page, letter, (x1 + 12, y2 - 12), cv2.FONT_HERSHEY_SIMPLEX, 1.3, 0, 3, cv2.LINE_AA)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def pages(self):
+        '''
+        0, 3, 4 are clean, 1 has no qr codes, 2 keeps one code and loses
+        its answer boxes so it can not be aligned
+        '''
+        (key0, page0), (_, page1), (key2, page2), (key3, page3), (key4, page4) = self.blanks
+        x1, y1, x2, y2 = self.plan.region
+        page2 = page2.copy()
+        page2[y1:y2, x1:x2] = 255
+        scans = [
+            scan_page(page0)[0],
+            scan_page(page1, hidden=list(config.qr.coords))[0],
+            scan_page(page2, hidden=['tr', 'bl'])[0],
+            scan_page(page3)[0],
+            scan_page(page4)[0]
+        ]
+        return scans, [key0, key2, key3, key4]
+
+    def make_set_copy(self, name):
+        path = os.path.join(self.dir.name, name)
+        os.makedirs(path)
+        for file_name in ('description.json', 'generator_data.json'):
+            shutil.copy(os.path.join(self.dir.name, file_name), path)
+        return path
+
+    def read_csv(self, path):
+        with open(os.path.join(path, 'recognized.csv')) as f:
+            return f.read()
+
+    def test_matches_restore_and_recognize(self):
+        scans, keys = self.pages()
+
+        separate_path = self.make_set_copy('separate')
+        separate = BlankRestorer(separate_path)
+        separate.restore_all(scans)
+        reader = BlankReader(separate_path, backend='onnx')
+        with contextlib.redirect_stdout(io.StringIO()):
+            reader.recognize_answers_in_folder(separate.scans_path)
+        reader.save_data(separate_path)
+
+        fused_path = self.make_set_copy('fused')
+        fused = BlankRestorer(fused_path)
+        reader = BlankReader(fused_path, backend='onnx')
+        with contextlib.redirect_stdout(io.StringIO()):
+            fused.restore_and_read(scans, reader, audit_every=3)
+        reader.save_data(fused_path)
+
+        # Fail_1 и страница без выравнивания сохраняются всегда, страницы 0 и 3 для аудита
+        self.assertEqual(
+            sorted(os.listdir(fused.scans_path)),
+            sorted([f'{keys[0]}.png', 'Fail_1.png', f'{keys[1]}.png', f'{keys[2]}.png'])
+        )
+        self.assertEqual(fused.get_logs(), separate.get_logs())
+        self.assertEqual(fused.get_logs()[0], [f'{keys[1]}: Only one QR code found.'])
+        fused_stats, separate_stats = fused.get_stats(), separate.get_stats()
+        # время восстановления от запуска к запуску разное
+        fused_stats['recovery'].pop('mean_ms')
+        separate_stats['recovery'].pop('mean_ms')
+        self.assertEqual(fused_stats, separate_stats)
+        self.assertEqual(self.read_csv(fused_path), self.read_csv(separate_path))
+        self.assertEqual(len(self.read_csv(fused_path).splitlines()), 1 + len(keys))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import os
+import tempfile
+import sys
+sys.path.append('../')
+from app.source.modules.watcher import InboxWatcher
+from app.source.utils.files import atomic_open
+
+
+class TestInboxWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.watcher = InboxWatcher(self.dir.name)
+        self.pdf = os.path.join(self.dir.name, 'scan.pdf')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_ready_after_size_settles(self):
+        with open(self.pdf, 'w') as f:
+            f.write('part')
+        self.assertEqual(self.watcher.ready_files(), [])
+        with open(self.pdf, 'a') as f:
+            f.write('rest')
+        self.assertEqual(self.watcher.ready_files(), [])
+        self.assertEqual(self.watcher.ready_files(), [self.pdf])
+
+    def test_archive_keeps_same_names(self):
+        for _ in range(2):
+            with open(self.pdf, 'w') as f:
+                f.write('pdf')
+            self.watcher.archive(self.pdf)
+        self.assertEqual(sorted(os.listdir(self.watcher.done_path)), ['scan.pdf', 'scan_1.pdf'])
+
+
+class TestAtomicOpen(unittest.TestCase):
+
+    def test_failed_write_keeps_old_file(self):
+        with tempfile.TemporaryDirectory() as path:
+            target = os.path.join(path, 'results.csv')
+            with atomic_open(target) as f:
+                f.write('old')
+            with self.assertRaises(RuntimeError):
+                with atomic_open(target) as f:
+                    f.write('new')
+                    raise RuntimeError
+            with open(target) as f:
+                self.assertEqual(f.read(), 'old')
+            self.assertEqual(os.listdir(path), ['results.csv'])
+
+    def test_file_mode(self):
+        with tempfile.TemporaryDirectory() as path:
+            plain = os.path.join(path, 'plain.csv')
+            with open(plain, 'w') as f:
+                f.write('old')
+            target = os.path.join(path, 'results.csv')
+            with atomic_open(target) as f:
+                f.write('new')
+            self.assertEqual(os.stat(target).st_mode, os.stat(plain).st_mode)
+
+            os.chmod(target, 0o640)
+            with atomic_open(target) as f:
+                f.write('newer')
+            self.assertEqual(os.stat(target).st_mode & 0o7777, 0o640)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,13 +5,16 @@ rebrikov-av@phystech.com
 import argparse
 
 from app.source.set_manager import SetManager
+from app.source.utils.metrics import metrics
 
 actions = [
     'create',
     'generate',
     'restore',
     'recognize',
-    'grade'
+    'process',
+    'grade',
+    'watch'
     ]
 
 if __name__ == '__main__':
@@ -27,17 +30,69 @@ if __name__ == '__main__':
                     type=str, 
                     required=True,
                     help=f'problem set name at dir ./sets/')
+    ap.add_argument("-j", 
+                    metavar='jobs', 
+                    type=int, 
+                    default=1,
+                    help=f'number of worker processes')
+    ap.add_argument("--split-prefix", 
+                    action='store_true',
+                    help=f'generate: separate pdf for every code prefix')
+    ap.add_argument("--pages-per-pdf", 
+                    metavar='pages', 
+                    type=int, 
+                    default=None,
+                    help=f'generate: split blanks into pdfs of this many pages')
+    ap.add_argument("--bilevel", 
+                    action='store_true',
+                    help=f'generate: store blanks with 1 bit per pixel')
+    ap.add_argument("--backend", 
+                    choices=['keras', 'onnx'], 
+                    default='keras',
+                    help=f'recognize, process, watch: inference backend, onnx needs the exported model')
+    ap.add_argument("--review-threshold", 
+                    metavar='conf', 
+                    type=float, 
+                    default=None,
+                    help=f'recognize: queue cells below this confidence to review.npz')
+    ap.add_argument("--profile", 
+                    metavar='file', 
+                    nargs='?', 
+                    const='profile.json',
+                    default=None,
+                    help=f'record time of every stage to json (or prometheus text for .prom)')
+    ap.add_argument("--store-matrix", 
+                    action='store_true',
+                    help=f'restore: keep raw scans with the alignment matrix instead of warped pages')
+    ap.add_argument("--audit-every", 
+                    metavar='n', 
+                    type=int, 
+                    default=0,
+                    help=f'process: also save every n-th aligned page to scans/')
     args = vars(ap.parse_args())
+    metrics.enabled = args['profile'] is not None
 
     
     if args['m'] == 'create':
         sm.create_set(args['s'])
     elif args['m'] == 'generate':
-        sm.generate_set(args['s'])
+        sm.generate_set(args['s'], 
+                        jobs=args['j'], 
+                        split_by_prefix=args['split_prefix'], 
+                        pages_per_file=args['pages_per_pdf'],
+                        bilevel=args['bilevel'])
     elif args['m'] == 'restore':
-        sm.restore_blanks(args['s'])
+        sm.restore_blanks(args['s'], jobs=args['j'], store_matrix=args['store_matrix'])
     elif args['m'] == 'recognize':
-        sm.get_answers(args['s'])
+        sm.get_answers(args['s'], jobs=args['j'], backend=args['backend'],
+                       review_threshold=args['review_threshold'])
+    elif args['m'] == 'process':
+        sm.process_set(args['s'], jobs=args['j'], backend=args['backend'], audit_every=args['audit_every'])
     elif args['m'] == 'grade':
         sm.get_results(args['s'])
-   
\ No newline at end of file
+    elif args['m'] == 'watch':
+        sm.watch_set(args['s'], jobs=args['j'], backend=args['backend'])
+
+    if metrics.enabled:
+        metrics.save(args['profile'])
+        print(metrics.to_dict())